@@ -0,0 +1,288 @@
+import bisect
+import json
+import logging
+import mmap
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from requesters import Log
+
+# Directory holding a subdirectory of segments per instance, empty to disable
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'data/logs')
+SEGMENT_SIZE = int(os.environ.get('ARCHIVE_SEGMENT_SIZE', 64 * 2 ** 20))
+# Retention per instance, the segment being written is always kept
+ARCHIVE_MAX_SIZE = int(os.environ.get('ARCHIVE_MAX_SIZE', 2 ** 30))
+ARCHIVE_MAX_AGE = float(os.environ.get('ARCHIVE_MAX_AGE', 30)) * 86400
+# Lines between two entries of a segment's offset index
+INDEX_EVERY = 1024
+# Blocks of line offsets kept decoded for reads
+CACHED_BLOCKS = 64
+# Bytes at the end of the archived log whose hash tells a restarted log apart
+TAIL_SIZE = 4096
+# Seconds between two saves of the archive state, it is saved on rotation and close too
+STATE_INTERVAL = float(os.environ.get('ARCHIVE_STATE_INTERVAL', 5))
+
+
+class Segment:
+    """
+    One append-only file of log lines, `<first line>.log`, and its
+    sparse index `<first line>.idx`, the byte offset of every
+    INDEX_EVERY-th line as int64.
+
+    Reads go through an mmap of the file, which is remapped when the
+    file grew past it.
+    """
+    def __init__(self, directory: str, first: int):
+        self.first = first
+        self.path = os.path.join(directory, f'{first:020d}.log')
+        self.index_path = os.path.join(directory, f'{first:020d}.idx')
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.newlines = 0
+        self.ends_line = True
+        self._map = None
+        self._offsets = np.fromfile(self.index_path, dtype=np.int64) \
+            if os.path.exists(self.index_path) else np.zeros(1, dtype=np.int64)
+
+        if self.size:
+            # Lines past the last index entry are counted from the file
+            indexed = (len(self._offsets) - 1) * INDEX_EVERY
+            self.newlines = indexed + self.map()[int(self._offsets[-1]):self.size].count(b'\n')
+            self.ends_line = self.map()[self.size - 1] == 10
+        elif not os.path.exists(self.index_path):
+            self._offsets.tofile(self.index_path)
+
+    def __len__(self) -> int:
+        return self.newlines + (not self.ends_line)
+
+    @property
+    def blocks(self) -> int:
+        """Number of index blocks, the last one still being filled."""
+        return len(self._offsets)
+
+    @property
+    def mtime(self) -> float:
+        return os.path.getmtime(self.path)
+
+    def map(self) -> mmap.mmap:
+        if self._map is None or len(self._map) < self.size:
+            self.close()
+            with open(self.path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._map
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def append(self, file, data: bytes):
+        """Writes `data` through the open `file` and indexes its lines."""
+        file.write(data)
+        newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + (self.size + 1)
+        numbers = np.arange(self.newlines + 1, self.newlines + 1 + len(newlines))
+        entries = newlines[numbers % INDEX_EVERY == 0]
+        if len(entries):
+            with open(self.index_path, 'ab') as index:
+                entries.astype(np.int64).tofile(index)
+            self._offsets = np.concatenate((self._offsets, entries))
+
+        self.size += len(data)
+        self.newlines += len(newlines)
+        self.ends_line = data[-1] == 10
+
+    def starts(self, block: int) -> np.ndarray:
+        """Byte offsets of the lines of index block `block` and of the line after."""
+        begin = int(self._offsets[block])
+        end = int(self._offsets[block + 1]) if block + 1 < len(self._offsets) else self.size
+        view = np.frombuffer(self.map(), dtype=np.uint8, count=end - begin, offset=begin)
+        return np.concatenate(([begin], np.flatnonzero(view == 10) + (begin + 1)))
+
+    def remove(self):
+        self.close()
+        for path in [self.path, self.index_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class LogArchive:
+    """
+    Everything received of one instance's log, on disk.
+
+    Appended to as logs arrive and rotated into segments of about
+    SEGMENT_SIZE bytes, cut at line ends. Lines are numbered from the
+    first line ever archived, `first` is the oldest one still kept once
+    segments were dropped by retention, by total size and by age.
+
+    A full log is archived once: the generation, size and a hash of the
+    last TAIL_SIZE bytes of what was archived are kept, a full log of
+    the same generation and tail only adds what is past them, e.g. when
+    the console restarts. Servers without generations restart their log
+    without changing it, the tail tells them apart. The state is saved
+    every STATE_INTERVAL seconds, a console that crashed may archive
+    again what was received since.
+    """
+    def __init__(self, directory: str,
+                 segment_size: int = SEGMENT_SIZE,
+                 max_size: int = ARCHIVE_MAX_SIZE,
+                 max_age: float = ARCHIVE_MAX_AGE):
+        self._logger = logging.getLogger('archive')
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+        firsts = sorted(int(name[:-4]) for name in os.listdir(directory)
+                        if re.fullmatch(r'\d{20}\.log', name))
+        self._segments = [Segment(directory, first) for first in firsts] or [Segment(directory, 0)]
+        self._firsts = [segment.first for segment in self._segments]
+        self._file = open(self._segments[-1].path, 'ab')
+        self._blocks = OrderedDict()
+
+        self._state_path = os.path.join(directory, 'state.json')
+        self._state = {'generation': None, 'size': 0, 'tail': None}
+        if os.path.exists(self._state_path):
+            with open(self._state_path) as file:
+                self._state.update(json.load(file))
+        # Last bytes of the log, unknown until a log that long arrives
+        self._tail = None
+        self._saved = time.monotonic()
+
+        self.prune()
+
+    @property
+    def first(self) -> int:
+        return self._segments[0].first
+
+    @property
+    def end(self) -> int:
+        """Number after the last line, the partial last line included."""
+        return self._segments[-1].first + len(self._segments[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def write(self, log: Log):
+        """Archives a log as received, the whole log or what was appended to it."""
+        data = log.content.encode()
+        size = log.size if log.size is not None else len(data)
+        if not log.append:
+            state = self._state
+            # Bytes of this log that were already archived
+            skip = state['size'] - (size - len(data))
+            same = state['generation'] == log.generation and size >= state['size'] \
+                and self._same_tail(data, skip)
+            self._tail = data[-TAIL_SIZE:] if len(data) >= TAIL_SIZE or len(data) == size else None
+            data = data[max(skip, 0):] if same else data
+            if not same and not self._segments[-1].ends_line:
+                # The log was rotated, its first line isn't part of the last one
+                data = b'\n' + data
+        else:
+            if log.size is None:
+                size = self._state['size'] + len(data)
+            if self._tail is not None or len(data) >= TAIL_SIZE:
+                self._tail = ((self._tail or b'') + data)[-TAIL_SIZE:]
+
+        generation = log.generation if log.generation is not None or not log.append \
+            else self._state['generation']
+        self._state = {'generation': generation, 'size': size,
+                       'tail': None if self._tail is None else zlib.crc32(self._tail)}
+        if data:
+            self.append(data)
+        if time.monotonic() - self._saved >= STATE_INTERVAL:
+            self.save()
+
+    def _same_tail(self, data: bytes, end: int) -> bool:
+        """Whether `data` has the archived tail before `end`, if it holds all of it."""
+        tail, length = self._state['tail'], min(TAIL_SIZE, self._state['size'])
+        if tail is None or end < length:
+            return True
+
+        return zlib.crc32(data[end - length:end]) == tail
+
+    def save(self):
+        """Saves what was archived, for the next console to go on from."""
+        with open(self._state_path + '.tmp', 'w') as file:
+            json.dump(self._state, file)
+        os.replace(self._state_path + '.tmp', self._state_path)
+        self._saved = time.monotonic()
+
+    def append(self, data: bytes):
+        segment = self._segments[-1]
+        segment.append(self._file, data)
+        self._file.flush()
+
+        if segment.size >= self.segment_size and segment.ends_line:
+            self._file.close()
+            segment = Segment(self.directory, self.end)
+            self._segments.append(segment)
+            self._firsts.append(segment.first)
+            self._file = open(segment.path, 'ab')
+            self.save()
+            self.prune()
+
+    def prune(self):
+        """Drops the oldest segments past the size or age limit."""
+        now = time.time()
+        total = self.nbytes
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            if total <= self.max_size and now - oldest.mtime <= self.max_age:
+                break
+
+            self._logger.info(f'Dropping archived segment {oldest.path}')
+            total -= oldest.size
+            oldest.remove()
+            del self._segments[0], self._firsts[0]
+            self._blocks = OrderedDict((key, value) for key, value in self._blocks.items()
+                                       if key[0] != oldest.first)
+
+    def open_segments(self) -> list:
+        """Every segment opened for reading, with its size now."""
+        return [(open(segment.path, 'rb'), segment.size) for segment in self._segments]
+
+    def _span(self, number: int) -> tuple:
+        """Segment and byte range of line `number`, without the newline."""
+        segment = self._segments[bisect.bisect_right(self._firsts, number) - 1]
+        index = number - segment.first
+        key = (segment.first, index // INDEX_EVERY)
+        starts = self._blocks.get(key)
+        # The block being written grows, its offsets are reread
+        if starts is None or key[1] >= segment.blocks - 1:
+            starts = segment.starts(key[1])
+            self._blocks[key] = starts
+            if len(self._blocks) > CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        self._blocks.move_to_end(key)
+
+        i = index % INDEX_EVERY
+        start = int(starts[i])
+        end = int(starts[i + 1]) - 1 if i + 1 < len(starts) else segment.size
+        return segment, start, end
+
+    def line(self, number: int) -> str:
+        segment, start, end = self._span(number)
+        return segment.map()[start:end].decode(errors='replace')
+
+    def close(self):
+        self.save()
+        self._file.close()
+        for segment in self._segments:
+            segment.close()
+
+
+def open_archive(url: str) -> Optional[LogArchive]:
+    """Archive of the instance at `url` under ARCHIVE_DIR, None if disabled."""
+    if not ARCHIVE_DIR:
+        return None
+
+    name = re.sub(r'[^\w.-]+', '_', url.split('://')[-1]).strip('_')
+    return LogArchive(os.path.join(ARCHIVE_DIR, name))
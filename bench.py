@@ -0,0 +1,301 @@
+"""
+Micro-benchmarks of the console's hot paths, run offscreen:
+
+    python bench.py charts
+    python bench.py convert
+    python bench.py logview
+    python bench.py search
+    python bench.py collector
+"""
+import argparse
+import io
+import os
+import random
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtGui import QImage, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+CHART_WIDTH = 320
+
+
+def timeit(func, frames: int) -> float:
+    """Mean milliseconds per call."""
+    func()
+    started = time.perf_counter()
+    for _ in range(frames):
+        func()
+
+    return (time.perf_counter() - started) / frames * 1000
+
+
+def samples(n: int = 10) -> list:
+    return [round(random.uniform(0, 512), 2) for _ in range(n)]
+
+
+def bench_charts(frames: int):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
+    from charts import BarChart, MplBarChart
+
+    def matplotlib_png():
+        # The pipeline MainWindow.updateVars used before BarChart
+        fig = plt.figure(figsize=(4, 4))
+        x = list(range(10))
+        plt.bar(x, samples(), width=0.9, color='#bfbf01')
+        plt.xticks(x)
+        plt.ylim([0, 512])
+        plt.margins(0.015, tight=True)
+        plt.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        plt.close(fig)
+
+        img = Image.open(buffer, formats=['png']).resize((CHART_WIDTH, CHART_WIDTH))
+        data = img.convert('RGBA').tobytes('raw', 'RGBA')
+        QPixmap.fromImage(QImage(data, CHART_WIDTH, CHART_WIDTH, QImage.Format_ARGB32))
+
+    chart = BarChart()
+    chart.resize(CHART_WIDTH, CHART_WIDTH)
+    chart.setMaximum(512)
+    image = QImage(CHART_WIDTH, CHART_WIDTH, QImage.Format_ARGB32_Premultiplied)
+
+    def qpainter():
+        chart.setValues(samples())
+        painter = QPainter(image)
+        chart.paint(painter)
+        painter.end()
+
+    mpl_chart = MplBarChart()
+    mpl_chart.resize(CHART_WIDTH, CHART_WIDTH)
+    mpl_chart.setMaximum(512)
+    mpl_chart.show()
+    QApplication.processEvents()
+
+    def blitting():
+        mpl_chart.setValues(samples())
+        QApplication.processEvents()
+
+    print(f'matplotlib -> PNG -> PIL -> QPixmap: {timeit(matplotlib_png, frames):8.3f} ms/frame')
+    print(f'MplBarChart (persistent, blitting):  {timeit(blitting, frames):8.3f} ms/frame')
+    print(f'BarChart (QPainter):                 {timeit(qpainter, frames):8.3f} ms/frame')
+
+
+def bench_convert(frames: int):
+    import tracemalloc
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from PIL import Image
+
+    from charts import convertImage
+
+    figure = Figure(figsize=(CHART_WIDTH / 100, CHART_WIDTH / 100), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    figure.add_subplot().bar(range(10), samples(), color='#bfbf01')
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    target = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+
+    def pil_copies():
+        # What convertImage used to do with the decoded chart
+        img = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        data = img.convert('RGBA').tobytes('raw', 'RGBA')
+        QPixmap.fromImage(QImage(data, width, height, QImage.Format_ARGB32))
+
+    def zero_copy():
+        image = convertImage(canvas.buffer_rgba(), width, height)
+        painter = QPainter(target)
+        painter.drawImage(0, 0, image)
+        painter.end()
+
+    for name, func in [('PIL convert + tobytes + QPixmap', pil_copies),
+                       ('convertImage (zero-copy)      ', zero_copy)]:
+        func()
+        tracemalloc.start()
+        for _ in range(frames):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name}: {timeit(func, frames):7.3f} ms/frame, '
+              f'{peak / 1024:8.1f} KiB peak Python allocation '
+              f'(frame is {width * height * 4 / 1024:.1f} KiB)')
+
+
+def bench_logview(frames: int):
+    from PyQt5.QtWidgets import QTextBrowser
+
+    from logview import LogView
+
+    def lines(n: int) -> str:
+        return ''.join(f'2021-11-02 12:00:00 - {random.choice(["INFO", "WARNING", "ERROR"])} - bot:'
+                       f'\tProcessed event #{random.randint(0, 10 ** 6)}\n' for _ in range(n))
+
+    chunk = 20
+    text_view, log_view = QTextBrowser(), LogView()
+    text_view.resize(600, 400)
+    log_view.resize(600, 400)
+    log_view.show()
+    content = ''
+    print('log lines   QTextBrowser.setPlainText   LogView append  (ms per update of +20 lines)')
+    for size in [1000, 5000, 20000, 50000]:
+        content += lines(size - content.count('\n'))
+        text_view.setPlainText(content)
+        log_view.model().setText(content)
+
+        def replace():
+            text_view.setPlainText(content + lines(chunk))
+
+        def append():
+            log_view.model().appendText(lines(chunk))
+            QApplication.processEvents()
+
+        print(f'{size:9d}   {timeit(replace, max(frames // 10, 3)):25.3f}   {timeit(append, frames):14.3f}')
+
+    # Millions of lines: memory of the store and cost of scrolling around
+    total = 5_000_000
+    block = lines(10000).encode()
+    model = log_view.model()
+    model.setText('')
+    store = model.store
+    started = time.perf_counter()
+    for _ in range(total // 10000):
+        store.append(block)
+    model.beginResetModel()
+    model.endResetModel()
+    print(f'{len(store)} lines loaded in {time.perf_counter() - started:.2f} s, '
+          f'{store.nbytes / 2 ** 20:.0f} MiB for {len(block) * (total // 10000) / 2 ** 20:.0f} MiB of text')
+
+    def scroll():
+        log_view.scrollTo(model.index(random.randrange(len(store))))
+        log_view.viewport().repaint()
+
+    print(f'scroll to a random line and repaint: {timeit(scroll, frames):.3f} ms')
+
+    for name, levels in [('errors', {40}), ('warnings and errors', {30, 40}), ('all', None)]:
+        print(f'filter {name}: {timeit(lambda: model.setFilter(levels=levels), frames):.3f} ms')
+
+
+def bench_search(frames: int):
+    import re
+
+    from logview import LogModel
+
+    words = 'event server restart timeout connection guild message lost'.split()
+
+    def lines(n: int) -> str:
+        return ''.join(f'2021-11-02 12:00:00 - INFO - bot:\t{random.choice(words)} {random.choice(words)}'
+                       f' #{random.randint(0, 10 ** 6)}\n' for _ in range(n))
+
+    model = LogModel()
+    block = lines(100000)
+    started = time.perf_counter()
+    while model.store.nbytes < 200 * 2 ** 20:
+        model.appendText(block)
+    model.appendText('2021-11-02 12:00:00 - ERROR - bot:\tshard 7 disconnected\n' + lines(500))
+    print(f'{len(model.store)} lines indexed in {time.perf_counter() - started:.1f} s')
+
+    text = model.store.text(0, len(model.store)).decode()
+    print('query                         index (ms)   re over the text (ms)')
+    for query, regex in [('shard 7', False), (r'shard \d+ disconnected', True), ('timeout lost', False)]:
+        pattern = re.compile(query if regex else re.escape(query), 0 if regex else re.IGNORECASE)
+        indexed = timeit(lambda: model.search_index.search(query, regex), frames)
+        plain = timeit(lambda: pattern.findall(text), max(frames // 10, 1))
+        print(f'{query:28}  {indexed:10.2f}   {plain:21.2f}')
+
+
+def bench_collector(frames: int):
+    import subprocess
+    import sys
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from PyQt5.QtCore import QThread, Qt
+
+    # Polls a local stub as fast as it answers, with the GUI idle or
+    # busy drawing matplotlib charts as it does with CHART_BACKEND=matplotlib
+    port = 8099
+    server = subprocess.Popen([sys.executable, 'stub_server.py', '--port', str(port), '--rate', '200'],
+                              stderr=subprocess.DEVNULL)
+    os.environ.update(APPLICATION_URL=f'http://127.0.0.1:{port}/', TRANSPORT='poll',
+                      POLL_INTERVAL='0.02', IDLE_INTERVAL='0.02', ARCHIVE_DIR='')
+    import index
+
+    def draw():
+        fig = plt.figure(figsize=(4, 4))
+        plt.bar(range(10), samples(), width=0.9)
+        plt.tight_layout()
+        fig.canvas.draw()
+        plt.close(fig)
+
+    seconds = max(frames / 10, 3)
+    print(f'{os.cpu_count()} CPUs, {seconds:.0f} s per run')
+    print('collector  GUI load   cycles/s   longest gap (ms)   frames/s')
+    try:
+        time.sleep(1)
+        for collector in ['thread', 'process']:
+            for busy in [False, True]:
+                thread = QThread()
+                handler = index.CollectorHandler() if collector == 'process' else index.GetHandler()
+                # Timed where the snapshots arrive, not when the GUI gets to them
+                arrived = []
+                handler.done.connect(lambda _: arrived.append(time.perf_counter()), Qt.DirectConnection)
+                handler.moveToThread(thread)
+                thread.started.connect(handler.start)
+                thread.start()
+                while not arrived:
+                    time.sleep(0.01)
+
+                started, drawn = time.perf_counter(), 0
+                while time.perf_counter() - started < seconds:
+                    if busy:
+                        draw()
+                        drawn += 1
+                    else:
+                        time.sleep(0.005)
+                    QApplication.processEvents()
+
+                handler.stop()
+                thread.wait(5000)
+                times = [t for t in arrived if t >= started]
+                gap = max(b - a for a, b in zip(times, times[1:])) * 1000
+                print(f'{collector:9}  {"charts" if busy else "idle":8}  {len(times) / seconds:9.1f}'
+                      f'   {gap:16.1f}   {drawn / seconds:8.1f}')
+    finally:
+        server.terminate()
+
+
+BENCHMARKS = {
+    'charts': bench_charts,
+    'convert': bench_convert,
+    'logview': bench_logview,
+    'search': bench_search,
+    'collector': bench_collector,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Console micro-benchmarks')
+    parser.add_argument('benchmark', choices=list(BENCHMARKS) + ['all'])
+    parser.add_argument('--frames', type=int, default=50)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    for name, bench in BENCHMARKS.items():
+        if args.benchmark in (name, 'all'):
+            print(f'# {name}')
+            bench(args.frames)
+
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import math
+import threading
+from typing import Sequence
+
+from PyQt5.QtCore import QObject, QRectF, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen
+from PyQt5.QtWidgets import QVBoxLayout, QWidget
+
+BAR_COLOR = '#bfbf01'
+Y_TICKS = 5
+DPI = 100
+
+
+def convertImage(buffer, width: int, height: int) -> QImage:
+    """
+    Wraps an RGBA8888 buffer, e.g. `FigureCanvasAgg.buffer_rgba()`,
+    in a QImage without copying the pixels.
+
+    The image references the buffer for as long as it lives, the
+    renderer must not draw into the buffer until the image is dropped.
+    Only the worker backend goes through an image, `ChartRenderer`
+    renders off the GUI thread, the other backends paint directly.
+    """
+    view = memoryview(buffer).cast('B')
+    image = QImage(view, width, height, width * 4, QImage.Format_RGBA8888)
+    # QImage doesn't keep a reference to the data it was built on
+    image.buffer = view
+    return image
+
+
+class BarChart(QWidget):
+    """
+    Bar chart painted directly with QPainter.
+
+    Only repaints when `setValues` receives values different from the
+    ones already shown.
+    """
+    def __init__(self, parent=None):
+        super(BarChart, self).__init__(parent)
+        self._values = []
+        self._ymax = 1.0
+        self._color = QColor(BAR_COLOR)
+        self._axis_pen = QPen(QColor('black'))
+
+    def setMaximum(self, ymax: float):
+        self._ymax = ymax
+        self.update()
+
+    def setValues(self, values: Sequence[float]):
+        values = list(values)
+        if values == self._values:
+            return
+
+        self._values = values
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        try:
+            self.paint(painter)
+        finally:
+            painter.end()
+
+    def paint(self, painter: QPainter):
+        painter.fillRect(self.rect(), Qt.white)
+
+        metrics = painter.fontMetrics()
+        ticks = [self._ymax * i / Y_TICKS for i in range(Y_TICKS + 1)]
+        left = max(metrics.horizontalAdvance(f'{tick:g}') for tick in ticks) + 10
+        bottom = metrics.height() + 6
+        plot = QRectF(self.rect()).adjusted(left, 8, -8, -bottom)
+
+        # Axes and ticks
+        painter.setPen(self._axis_pen)
+        painter.drawLine(plot.bottomLeft(), plot.topLeft())
+        painter.drawLine(plot.bottomLeft(), plot.bottomRight())
+        for i, tick in enumerate(ticks):
+            y = plot.bottom() - plot.height() * i / Y_TICKS
+            painter.drawLine(int(plot.left()) - 3, int(y), int(plot.left()), int(y))
+            painter.drawText(QRectF(0, y - metrics.height() / 2, left - 5, metrics.height()),
+                             Qt.AlignRight | Qt.AlignVCenter, f'{tick:g}')
+
+        if not self._values:
+            return
+
+        slot = plot.width() / len(self._values)
+        width = slot * 0.9
+        label_every = max(1, math.ceil(len(self._values) / 20))
+        for i, value in enumerate(self._values):
+            x = plot.left() + slot * i + (slot - width) / 2
+            if i % label_every == 0:
+                painter.drawText(QRectF(x, plot.bottom() + 3, width, metrics.height()),
+                                 Qt.AlignHCenter | Qt.AlignTop, str(i))
+
+            if math.isnan(value) or value <= 0:
+                continue
+
+            height = plot.height() * min(value / self._ymax, 1.0)
+            painter.fillRect(QRectF(x, plot.bottom() - height, width, height), self._color)
+
+
+class MplBarChart(QWidget):
+    """
+    Matplotlib bar chart drawn once and then updated in place.
+
+    The axes, ticks and background are rendered on full draws only and
+    cached, updates set the heights of the existing bars and blit just
+    the axes area. Needs matplotlib, which is imported lazily.
+    """
+    def __init__(self, parent=None):
+        super(MplBarChart, self).__init__(parent)
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+        from matplotlib.figure import Figure
+
+        self._figure = Figure(figsize=(4, 4))
+        self._canvas = FigureCanvasQTAgg(self._figure)
+        self._axes = self._figure.add_subplot()
+        self._bars = []
+        self._values = []
+        self._background = None
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._canvas)
+
+        self._canvas.mpl_connect('draw_event', self._onDraw)
+        self.setValues([0] * 10)
+
+    def setMaximum(self, ymax: float):
+        self._axes.set_ylim([0, ymax])
+        self._canvas.draw_idle()
+
+    def setValues(self, values: Sequence[float]):
+        values = list(values)
+        if values == self._values:
+            return
+
+        resized = len(values) != len(self._values)
+        self._values = values
+        if resized:
+            self._rebuild()
+            return
+
+        for bar, value in zip(self._bars, values):
+            bar.set_height(self._height(value))
+        self._blit()
+
+    @staticmethod
+    def _height(value: float) -> float:
+        return 0 if math.isnan(value) or value <= 0 else value
+
+    def _rebuild(self):
+        for bar in self._bars:
+            bar.remove()
+
+        x = list(range(len(self._values)))
+        self._bars = list(self._axes.bar(x, [self._height(v) for v in self._values],
+                                         width=0.9, color=BAR_COLOR, animated=True))
+        self._axes.set_xticks(x)
+        self._axes.set_xlim(-0.5, len(x) - 0.5)
+        self._figure.tight_layout()
+        self._canvas.draw()
+
+    def _onDraw(self, event):
+        # Full redraw (first show, resize, new range): cache the static parts
+        self._background = self._canvas.copy_from_bbox(self._axes.bbox)
+        self._drawBars()
+
+    def _drawBars(self):
+        for bar in self._bars:
+            self._axes.draw_artist(bar)
+        self._canvas.blit(self._axes.bbox)
+
+    def _blit(self):
+        if self._background is None:
+            self._canvas.draw_idle()
+            return
+
+        self._canvas.restore_region(self._background)
+        self._drawBars()
+
+
+class _AggChart:
+    """
+    Two off-screen Agg figures of one chart, drawn into alternately so
+    the frame on screen is never overwritten by the one being rendered.
+    """
+    def __init__(self, ymax: float):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.ymax = ymax
+        self._canvases = [FigureCanvasAgg(Figure(dpi=DPI)) for _ in range(2)]
+        self._bars = [[], []]
+        self._size = None
+        self._count = None
+        self._current = 0
+
+    def _setup(self, canvas, count: int, size: tuple) -> list:
+        figure = canvas.figure
+        figure.clear()
+        figure.set_size_inches(size[0] / DPI, size[1] / DPI)
+        axes = figure.add_subplot()
+        x = list(range(count))
+        bars = list(axes.bar(x, [0] * count, width=0.9, color=BAR_COLOR))
+        axes.set_xticks(x)
+        axes.set_xlim(-0.5, count - 0.5)
+        axes.set_ylim([0, self.ymax])
+        figure.tight_layout()
+        return bars
+
+    def render(self, values: list, size: tuple) -> QImage:
+        if (len(values), size) != (self._count, self._size):
+            self._count, self._size = len(values), size
+            self._bars = [self._setup(canvas, len(values), size)
+                          for canvas in self._canvases]
+
+        self._current = 1 - self._current
+        canvas = self._canvases[self._current]
+        for bar, value in zip(self._bars[self._current], values):
+            bar.set_height(0 if math.isnan(value) or value <= 0 else value)
+        canvas.draw()
+
+        width, height = canvas.get_width_height()
+        return convertImage(canvas.buffer_rgba(), width, height)
+
+
+class ChartRenderer(QObject):
+    """
+    Renders charts with matplotlib's Agg backend on its own thread.
+
+    Only the latest values submitted for a chart are rendered, frames
+    that became stale while another one was rendering are dropped. A
+    chart has at most one frame in flight: its next frame is not
+    rendered until the GUI reports the previous one as shown, so the
+    two Agg buffers of a chart are never drawn into while displayed.
+    """
+    rendered = pyqtSignal(str, object)
+    _wake = pyqtSignal()
+
+    def __init__(self):
+        super(ChartRenderer, self).__init__()
+        self._lock = threading.Lock()
+        self._charts = {}
+        self._pending = {}
+        self._in_flight = set()
+        # A slot, so that it runs on the thread the renderer was moved to
+        self._wake.connect(self._render, Qt.QueuedConnection)
+
+    def addChart(self, name: str, ymax: float):
+        self._charts[name] = _AggChart(ymax)
+
+    def submit(self, name: str, values: list, size: tuple):
+        """Thread-safe, replaces values of `name` not rendered yet."""
+        with self._lock:
+            self._pending[name] = (values, size)
+        self._wake.emit()
+
+    def frameShown(self, name: str):
+        with self._lock:
+            self._in_flight.discard(name)
+        self._wake.emit()
+
+    @pyqtSlot()
+    def _render(self):
+        while True:
+            with self._lock:
+                ready = [name for name in self._pending if name not in self._in_flight]
+                if not ready:
+                    return
+
+                name = ready[0]
+                values, size = self._pending.pop(name)
+                self._in_flight.add(name)
+
+            self.rendered.emit(name, self._charts[name].render(values, size))
+
+
+class ImageChart(QWidget):
+    """Shows the frames a `ChartRenderer` renders for chart `name`."""
+    def __init__(self, renderer: ChartRenderer, name: str, parent=None):
+        super(ImageChart, self).__init__(parent)
+        self._renderer = renderer
+        self._name = name
+        self._values = []
+        self._image = None
+        renderer.rendered.connect(self.onRendered)
+
+    def setMaximum(self, ymax: float):
+        self._renderer.addChart(self._name, ymax)
+
+    def setValues(self, values: Sequence[float]):
+        values = list(values)
+        if values == self._values:
+            return
+
+        self._values = values
+        self._renderer.submit(self._name, values, (self.width(), self.height()))
+
+    def resizeEvent(self, event):
+        if self._values:
+            self._renderer.submit(self._name, self._values, (self.width(), self.height()))
+        super().resizeEvent(event)
+
+    def onRendered(self, name: str, image: QImage):
+        if name != self._name:
+            return
+
+        self._image = image
+        self.update()
+        self._renderer.frameShown(name)
+
+    def paintEvent(self, event):
+        if self._image is None:
+            return
+
+        painter = QPainter(self)
+        painter.drawImage(0, 0, self._image)
+        painter.end()
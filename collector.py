@@ -0,0 +1,218 @@
+import logging
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from poller import Poller
+from requesters import Log, Vars
+from scheduler import PollScheduler
+
+# Bytes of snapshots the collector process can be ahead of the GUI
+RING_SIZE = int(os.environ.get('COLLECTOR_RING_SIZE', 16 * 2 ** 20))
+# The write and read positions sit on cache lines of their own
+_HEADER = 128
+_READ_AT = 64
+# Record length, then instance and which fields follow
+_LENGTH = struct.Struct('<I')
+_RECORD = struct.Struct('<IHB')
+_STATUS = struct.Struct('<B')
+_VARS = struct.Struct('<dIB')
+_LOG = struct.Struct('<q?HI')
+_NO_GENERATION = 0xFFFF
+
+_HAS_STATUS, _HAS_VARS, _HAS_LOG = 1, 2, 4
+
+
+def _split_log(log: Log, limit: int) -> Iterator[Log]:
+    """`log` as logs of at most `limit` content bytes, cut between characters."""
+    data = log.content.encode()
+    start = 0
+    while True:
+        end = min(start + limit, len(data))
+        # UTF-8 continuation bytes never start a character
+        while 0 < end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        size = None if log.size is None else log.size - (len(data) - end)
+        yield Log.construct(content=data[start:end].decode(), size=size,
+                            generation=log.generation, append=log.append or start > 0)
+        if end >= len(data):
+            return
+        start = end
+
+
+class SnapshotRing:
+    """
+    Snapshots passed from one writing process to one reading process
+    through a ring buffer in shared memory.
+
+    Snapshots are packed as records of fixed-layout fields and strings,
+    no pickling or JSON: the reader unpacks them straight from the
+    shared buffer. The write and read positions count bytes since the
+    start and are only ever moved forward by their own side, so no lock
+    is needed. A writer ahead of the reader by the whole ring waits for
+    it, a log longer than a quarter of the ring is split into appends.
+    """
+    def __init__(self, name: str = None, size: int = RING_SIZE):
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=_HEADER + size)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+
+        self.name = self._memory.name
+        self.size = self._memory.size - _HEADER
+        self._buf = self._memory.buf
+        self._written = np.ndarray(1, dtype=np.uint64, buffer=self._buf, offset=0)
+        self._read = np.ndarray(1, dtype=np.uint64, buffer=self._buf, offset=_READ_AT)
+
+    @staticmethod
+    def _encode(instance: int, snapshot: dict) -> bytes:
+        fields, parts = 0, []
+        if 'status' in snapshot:
+            status = snapshot['status'].encode()[:255]
+            fields |= _HAS_STATUS
+            parts += [_STATUS.pack(len(status)), status]
+        if 'vars' in snapshot:
+            vars_: Vars = snapshot['vars']
+            memory = vars_.memory_used.encode()[:255]
+            fields |= _HAS_VARS
+            parts += [_VARS.pack(vars_.cpu_used, vars_.servers, len(memory)), memory]
+        if 'log' in snapshot:
+            log: Log = snapshot['log']
+            generation = log.generation.encode() if log.generation is not None else b''
+            content = log.content.encode()
+            fields |= _HAS_LOG
+            parts += [_LOG.pack(-1 if log.size is None else log.size, log.append,
+                                _NO_GENERATION if log.generation is None else len(generation),
+                                len(content)),
+                      generation, content]
+
+        body = b''.join(parts)
+        return _RECORD.pack(_RECORD.size + len(body), instance, fields) + body
+
+    def put(self, instance: int, snapshot: dict, stopping=None) -> bool:
+        """
+        Writes `snapshot` of the instance numbered `instance`, waiting
+        while the ring is full. Returns False if `stopping` was set first.
+        """
+        if 'log' in snapshot and len(snapshot['log'].content) > self.size // 16:
+            logs = list(_split_log(snapshot['log'], self.size // 4))
+            if len(logs) > 1:
+                rest = {key: value for key, value in snapshot.items() if key != 'log'}
+                return all(self.put(instance, {**rest, 'log': log} if i == 0 else {'log': log},
+                                    stopping)
+                           for i, log in enumerate(logs))
+
+        record = self._encode(instance, snapshot)
+        written = int(self._written[0])
+        offset = written % self.size
+        # Records are never cut by the end of the ring
+        skip = self.size - offset if self.size - offset < len(record) else 0
+        while self.size - (written - int(self._read[0])) < skip + len(record):
+            if stopping is not None and stopping.is_set():
+                return False
+            time.sleep(0.001)
+
+        if skip >= _LENGTH.size:
+            _LENGTH.pack_into(self._buf, _HEADER + offset, 0)
+        start = _HEADER + (written + skip) % self.size
+        self._buf[start:start + len(record)] = record
+        # Published only once the record is in place
+        self._written[0] = written + skip + len(record)
+        return True
+
+    def _decode(self, start: int) -> Tuple[int, dict]:
+        buf = self._buf
+        _, instance, fields = _RECORD.unpack_from(buf, start)
+        at = start + _RECORD.size
+        snapshot = {}
+        if fields & _HAS_STATUS:
+            length, = _STATUS.unpack_from(buf, at)
+            at += _STATUS.size
+            snapshot['status'] = str(buf[at:at + length], 'utf-8')
+            at += length
+        if fields & _HAS_VARS:
+            cpu_used, servers, length = _VARS.unpack_from(buf, at)
+            at += _VARS.size
+            snapshot['vars'] = Vars.construct(cpu_used=cpu_used, servers=servers,
+                                              memory_used=str(buf[at:at + length], 'utf-8'))
+            at += length
+        if fields & _HAS_LOG:
+            size, append, generation_length, length = _LOG.unpack_from(buf, at)
+            at += _LOG.size
+            generation = None
+            if generation_length != _NO_GENERATION:
+                generation = str(buf[at:at + generation_length], 'utf-8')
+                at += generation_length
+            snapshot['log'] = Log.construct(content=str(buf[at:at + length], 'utf-8', 'replace'),
+                                            size=None if size < 0 else size,
+                                            generation=generation, append=append)
+
+        return instance, snapshot
+
+    def take(self) -> Iterator[Tuple[int, dict]]:
+        """Instance numbers and snapshots written since the last call, in order."""
+        read, written = int(self._read[0]), int(self._written[0])
+        while read < written:
+            offset = read % self.size
+            length = _LENGTH.unpack_from(self._buf, _HEADER + offset)[0] \
+                if self.size - offset >= _LENGTH.size else 0
+            if length == 0:
+                # The writer skipped to the start of the ring
+                read += self.size - offset
+                continue
+
+            yield self._decode(_HEADER + offset)
+            read += length
+            self._read[0] = read
+
+        self._read[0] = read
+
+    def close(self):
+        del self._written, self._read
+        self._buf = None
+        self._memory.close()
+
+    def unlink(self):
+        self._memory.unlink()
+
+
+class _SharedScheduler(PollScheduler):
+    """A `PollScheduler` whose `background` is a value shared with the GUI."""
+    def __init__(self, background):
+        super(_SharedScheduler, self).__init__()
+        self._background = background
+
+    @property
+    def background(self) -> bool:
+        return bool(self._background.value)
+
+    @background.setter
+    def background(self, value: bool):
+        # Only the GUI sets it, PollScheduler's initial False is ignored
+        pass
+
+
+def collect(name: str, urls: list, transport: str, stopping, background,
+            level: int = logging.INFO):
+    """
+    Entry point of the collector process: polls or streams `urls` into
+    the ring `name` until `stopping` is set. `background` mirrors
+    whether the window is minimized, `level` is the GUI's log level.
+    """
+    logging.basicConfig(level=level,
+                        format='%(asctime)s - %(levelname)s - %(name)s:\t%(message)s',
+                        datefmt='%y.%b.%Y %H:%M:%S')
+    ring = SnapshotRing(name)
+
+    def emit(snapshots: dict):
+        for url, snapshot in snapshots.items():
+            ring.put(urls.index(url), snapshot, stopping)
+
+    try:
+        Poller(urls, emit, transport, _SharedScheduler(background), stopping).run()
+    finally:
+        ring.close()
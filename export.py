@@ -0,0 +1,137 @@
+import gzip
+import importlib.util
+import logging
+import os
+import threading
+import time
+from typing import Iterator, Tuple
+
+from PyQt5.QtCore import QObject, Qt, pyqtSignal, pyqtSlot
+
+# Bytes read and written at a time, the most held in memory by an export
+EXPORT_CHUNK = int(os.environ.get('EXPORT_CHUNK', 2 ** 20))
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def zstd_available() -> bool:
+    return importlib.util.find_spec('zstandard') is not None
+
+
+def file_filters() -> list:
+    """File dialog filters of the supported formats, plain text first."""
+    filters = ['Log (*.log)', 'Gzip compressed log (*.log.gz)']
+    if zstd_available():
+        filters.append('Zstandard compressed log (*.log.zst)')
+    return filters
+
+
+def open_output(path: str):
+    """Binary file at `path`, compressed as its extension says."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+    if path.endswith('.zst'):
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def archive_chunks(archive) -> Tuple[int, Iterator[bytes]]:
+    """
+    Size and chunks of everything in `archive` now. Segment files are
+    opened right away, segments dropped during the export are still read.
+    """
+    files = archive.open_segments()
+
+    def chunks():
+        try:
+            for file, size in files:
+                while size > 0:
+                    data = file.read(min(EXPORT_CHUNK, size))
+                    if not data:
+                        break
+                    size -= len(data)
+                    yield data
+        finally:
+            for file, _ in files:
+                file.close()
+
+    return sum(size for _, size in files), chunks()
+
+
+def store_chunks(store) -> Tuple[int, Iterator[bytes]]:
+    """Size and chunks of what `store` holds now, read as the export goes."""
+    position, end, resets = store.end - store.size, store.end, store.resets
+
+    def chunks():
+        nonlocal position
+        while position < end:
+            data, position = store.read(position, min(EXPORT_CHUNK, end - position), resets)
+            if not data:
+                return
+            yield data
+
+    return end - position, chunks()
+
+
+class LogExporter(QObject):
+    """
+    Writes chunks of a log to a file on the thread it was moved to.
+
+    Only one chunk is held at a time, however large the log, and the
+    file is compressed on the fly as `open_output` picks. A cancelled or
+    failed export removes the partial file.
+    """
+    progress = pyqtSignal('qint64', 'qint64')
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    _start = pyqtSignal('qint64', object, str)
+
+    def __init__(self):
+        super(LogExporter, self).__init__()
+        self._logger = logging.getLogger('export')
+        self._cancelled = threading.Event()
+        # A slot, so that it runs on the thread the exporter was moved to
+        self._start.connect(self._export, Qt.QueuedConnection)
+
+    def start(self, total: int, chunks: Iterator[bytes], path: str):
+        self._cancelled.clear()
+        self._start.emit(total, chunks, path)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @pyqtSlot('qint64', object, str)
+    def _export(self, total: int, chunks: Iterator[bytes], path: str):
+        started = time.perf_counter()
+        written = 0
+        try:
+            with open_output(path) as output:
+                for data in chunks:
+                    if self._cancelled.is_set():
+                        break
+                    output.write(data)
+                    written += len(data)
+                    self.progress.emit(written, total)
+        except (OSError, ImportError) as e:
+            self._logger.warning(f'Failed exporting log to {path}: {e}')
+            self._remove(path)
+            self.failed.emit(str(e))
+            return
+        finally:
+            chunks.close()
+
+        if self._cancelled.is_set():
+            self._remove(path)
+            self.failed.emit('Cancelled')
+            return
+
+        self._logger.info(f'Exported {written} bytes of log to {path} '
+                          f'in {time.perf_counter() - started:.2f} s')
+        self.finished.emit(path)
+
+    @staticmethod
+    def _remove(path: str):
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,47 +1,401 @@
-import io
-import json
+import bisect
 import logging
+import multiprocessing
 import os
+import queue
+import re
 import sys
+import threading
 import time
+import uuid
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlparse
 
 import dotenv
-import matplotlib.pyplot as plt
-from PIL import Image
+import requests
 from PyQt5 import QtGui, QtCore
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject
-from PyQt5.QtGui import QImage, QPixmap, QFontDatabase, QFont
-from PyQt5.QtWidgets import QApplication, QMainWindow
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, pyqtSlot, QObject
+from PyQt5.QtGui import QFontDatabase, QFont
+from PyQt5.QtWidgets import QAbstractItemView, QApplication, QFileDialog, QMainWindow, QWidget
 from PyQt5.uic import loadUi
 
-from requesters import GetRequester, PostRequester, Vars
+from archive import open_archive
+from charts import ChartRenderer, ImageChart, MplBarChart
+from collector import SnapshotRing, collect
+from export import LogExporter, archive_chunks, file_filters, store_chunks
+from logsearch import compile_query
+from logview import LogModel
+from metrics import ROLLUP_RESOLUTIONS, Downsampler, MetricHistory
+from poller import Poller
+from requesters import CYCLE_TIMEOUT, CommandResult, PostRequester, Vars, Log
+from scheduler import FINGERPRINT_TAIL, PollScheduler, fingerprint
 import resources
 
-CHART_WIDTH = 320
+TRANSPORT = os.environ.get('TRANSPORT', 'stream')
+# 'process' polls from a child process, see collector.py
+COLLECTOR = os.environ.get('COLLECTOR', 'thread')
+# Milliseconds between two reads of the collector process' snapshots
+COLLECTOR_INTERVAL = int(os.environ.get('COLLECTOR_INTERVAL', 20))
+CHART_BACKEND = os.environ.get('CHART_BACKEND', 'qpainter')
+# Samples shown live, 0 for the whole history
+CHART_SAMPLES = int(os.environ.get('CHART_SAMPLES', 10))
+MIN_BAR_WIDTH = 3
+# Seconds the window waits for the poller's and the command sender's threads on close
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 1))
+APPLICATION_URLS = [
+    url.strip() for url in
+    os.environ.get('APPLICATION_URLS', os.environ.get('APPLICATION_URL', '')).split(',')
+    if url.strip()
+]
 
 
 class GetHandler(QObject):
+    """
+    Drives a `Poller` from the thread it was moved to.
+
+    Nothing blocks that thread's event loop: a poll cycle submits the
+    requests of every instance and returns, it ends once they all
+    finished or at the CYCLE_TIMEOUT deadline, and a timer starts the
+    next cycle. Reading a stream blocks, so it is read on a thread of
+    its own. `stop` ends either at once, requests in flight are
+    cancelled if not started yet and otherwise dropped.
+    """
     done = pyqtSignal(object)
-    getter = GetRequester(os.environ.get('APPLICATION_URL'))
+    _settled = pyqtSignal()
+    _fallback = pyqtSignal()
+    _stop = pyqtSignal()
 
-    def loop(self):
-        while True:
-            response = self.getter.response
-            self.done.emit(response)
+    def __init__(self):
+        super(GetHandler, self).__init__()
+        self.poller = Poller(APPLICATION_URLS, self.done.emit, TRANSPORT)
+        self._next = None
+        self._deadline = None
+        # Slots, not plain methods, so that they run on the thread moved to
+        self._settled.connect(self._settle, Qt.QueuedConnection)
+        self._fallback.connect(self._cycle, Qt.QueuedConnection)
+        self._stop.connect(self._halt, Qt.QueuedConnection)
+
+    def start(self):
+        """Starts polling or streaming, on the handler's thread."""
+        self._next = QTimer(self)
+        self._next.setSingleShot(True)
+        self._next.timeout.connect(self._cycle)
+        self._deadline = QTimer(self)
+        self._deadline.setSingleShot(True)
+        self._deadline.timeout.connect(self._finish)
+
+        if self.poller.streams:
+            threading.Thread(target=self._stream, name='stream', daemon=True).start()
+        else:
+            self._cycle()
+
+    def stop(self):
+        """Stops polling or streaming and then quits the handler's thread, from any thread."""
+        self.poller.stop()
+        self._stop.emit()
+
+    def setBackground(self, background: bool):
+        self.poller.scheduler.background = background
+
+    @pyqtSlot()
+    def _halt(self):
+        # Timers can only be stopped on their own thread
+        if self._next is not None:
+            self._next.stop()
+            self._deadline.stop()
+        self.thread().quit()
+
+    def _stream(self):
+        if not self.poller.stream():
+            self._fallback.emit()
+
+    @pyqtSlot()
+    def _cycle(self):
+        if self.poller.stopping.is_set():
+            return
 
-            time.sleep(0.3)
+        self._deadline.start(int(CYCLE_TIMEOUT * 1000))
+        for future in self.poller.submit():
+            future.add_done_callback(self._onDone)
 
+    def _onDone(self, future):
+        # On a worker thread, possibly once the handler is gone
+        if not self.poller.stopping.is_set():
+            self._settled.emit()
 
-class PostHandler(QObject):
+    @pyqtSlot()
+    def _settle(self):
+        """Ends the cycle early once every request of it finished."""
+        if self.poller.cycling and self.poller.settled:
+            self._finish()
+
+    @pyqtSlot()
+    def _finish(self):
+        if not self.poller.cycling or self.poller.stopping.is_set():
+            return
+
+        self._deadline.stop()
+        self._next.start(int(self.poller.finish() * 1000))
+
+
+class CollectorHandler(QObject):
+    """
+    Relays the snapshots of a collector process, a `GetHandler` whose
+    polling runs in `collector.collect` instead.
+
+    Requests, JSON parsing and validation happen in that process, outside
+    of this one's GIL, so their timing doesn't depend on how busy the GUI
+    is. The process writes snapshots into a `SnapshotRing` that is read
+    every COLLECTOR_INTERVAL ms on the thread the handler was moved to.
+    """
     done = pyqtSignal(object)
-    poster = PostRequester(os.environ.get('APPLICATION_URL'))
+    _stop = pyqtSignal()
+
+    def __init__(self):
+        super(CollectorHandler, self).__init__()
+        # Spawned, forking would copy the GUI's threads and locks
+        self._context = multiprocessing.get_context('spawn')
+        self._stopping = self._context.Event()
+        self._background = self._context.Value('b', False)
+        self._ring = None
+        self._process = None
+        self._timer = None
+        self._respawn = None
+        # Backs off restarts of a collector that keeps exiting
+        self._restarts = PollScheduler()
+        self._stop.connect(self._halt, Qt.QueuedConnection)
+
+    def start(self):
+        self._ring = SnapshotRing()
+        self._spawn()
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._drain)
+        self._timer.start(COLLECTOR_INTERVAL)
+        self._respawn = QTimer(self)
+        self._respawn.setSingleShot(True)
+        self._respawn.timeout.connect(self._spawn)
+
+    @pyqtSlot()
+    def _spawn(self):
+        if self._stopping.is_set():
+            return
+
+        self._process = self._context.Process(
+            target=collect, name='collector', daemon=True,
+            args=(self._ring.name, APPLICATION_URLS, TRANSPORT, self._stopping, self._background,
+                  logging.getLogger().getEffectiveLevel())
+        )
+        self._process.start()
+
+    def stop(self):
+        """Stops the collector process and then quits the handler's thread, from any thread."""
+        self._stopping.set()
+        self._stop.emit()
+
+    def setBackground(self, background: bool):
+        self._background.value = background
+
+    @pyqtSlot()
+    def _halt(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._respawn.stop()
+        if self._process is not None:
+            # It may be waiting for a request, nothing it holds needs cleaning up
+            self._process.join(SHUTDOWN_TIMEOUT / 2)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._ring.close()
+            self._ring.unlink()
+        self.thread().quit()
+
+    @pyqtSlot()
+    def _drain(self):
+        # Snapshots of one cycle are relayed together, like GetHandler's
+        snapshots = {}
+        for instance, snapshot in self._ring.take():
+            self._restarts.reset()
+            url = APPLICATION_URLS[instance]
+            if url in snapshots:
+                self.done.emit(snapshots)
+                snapshots = {}
+            snapshots[url] = snapshot
+        if snapshots:
+            self.done.emit(snapshots)
+
+        alive = self._process.is_alive()
+        if not alive and not self._respawn.isActive() and not self._stopping.is_set():
+            delay = self._restarts.next_interval({'collector': {'status': 'unknown'}})
+            logging.getLogger('index').warning(
+                f'Collector process exited with code {self._process.exitcode}, '
+                f'restarting it in {delay:.1f} s')
+            self._respawn.start(int(delay * 1000))
 
-    def post(self, instruction):
-        res = self.poster.post(instruction)
-        if not res.ok:
-            pass
 
-        self.done.emit(res.status_code)
+class PostHandler(QObject):
+    """
+    Sends bot commands from its own thread.
+
+    `post` only queues a command and returns, `serve` sends queued
+    commands one by one and reports each as a `CommandResult` on `done`,
+    so neither the GUI nor the poller ever wait for the bot.
+
+    An instance has at most one command queued and one being sent. A
+    command identical to the latest pending one merges into it, a
+    different one replaces the queued command: only the last intent is
+    sent. Every command carries an idempotency key, kept by merges, so a
+    retried request can't be applied twice.
+
+    Requests are made on a daemon thread that `serve` waits for, so
+    `stop` returns at once however long the bot takes to answer.
+    """
+    done = pyqtSignal(object)
+    posters = {url: PostRequester(url) for url in APPLICATION_URLS}
+
+    def __init__(self):
+        super(PostHandler, self).__init__()
+        # Instances with a command queued, the commands are in `_queued`
+        self.commands = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued = {}
+        self._sending = {}
+        self._stopping = threading.Event()
+        # Set by the request thread once a command is sent
+        self._replies = queue.Queue()
+
+    def post(self, instruction, instance: str = None):
+        """Queues `instruction` for `instance`, or for every instance if None."""
+        for url in [instance] if instance else self.posters:
+            with self._lock:
+                queued, sending = self._queued.get(url), self._sending.get(url)
+                latest = queued or sending
+                if latest is not None and latest['instruction'] == instruction:
+                    latest['merged'] += 1
+                    continue
+
+                if queued is not None:
+                    # Superseded before it was sent, its queue entry is reused
+                    del self._queued[url]
+                if sending is not None and sending['instruction'] == instruction:
+                    sending['merged'] += 1
+                    continue
+
+                self._queued[url] = {
+                    'instruction': instruction,
+                    'key': uuid.uuid4().hex,
+                    'queued': time.perf_counter(),
+                    'merged': 0
+                }
+                if queued is None:
+                    self.commands.put(url)
+
+    def stop(self):
+        """
+        Makes `serve` return right away, the queued commands are dropped
+        and the command being sent is no longer reported.
+        """
+        with self._lock:
+            dropped, self._queued = self._queued, {}
+        if dropped:
+            logging.getLogger('index').info(f'Dropping commands to {", ".join(dropped)}')
+        self._stopping.set()
+        self.commands.put(None)
+        self._replies.put(None)
+
+    def serve(self):
+        while True:
+            url = self.commands.get()
+            if url is None:
+                return
+
+            with self._lock:
+                command = self._queued.pop(url, None)
+                if command is None:
+                    continue
+                self._sending[url] = command
+
+            threading.Thread(target=self._send, args=(url, command), name='command', daemon=True).start()
+            if self._replies.get() is None:
+                return
+
+    def _send(self, url: str, command: dict):
+        started = time.perf_counter()
+        status_code, error = None, None
+        try:
+            status_code = self.posters[url].post(command['instruction'], command['key']).status_code
+        except requests.RequestException as e:
+            error = str(e)
+
+        with self._lock:
+            del self._sending[url]
+
+        if not self._stopping.is_set():
+            self.done.emit(CommandResult(
+                instruction=command['instruction'],
+                instance=url,
+                key=command['key'],
+                merged=command['merged'],
+                status_code=status_code,
+                error=error,
+                waited=started - command['queued'],
+                elapsed=time.perf_counter() - started
+            ))
+        self._replies.put(True)
+
+
+class ChangeDetector:
+    """
+    Strips snapshot fields that match what the window already shows.
+
+    Fields are compared by `scheduler.fingerprint`, appended log chunks
+    by being non-empty. A full log that merely grew is passed on as an
+    append of the new part.
+    """
+    def __init__(self):
+        self._fingerprints = {}
+        self.updated = Counter()
+        self.skipped = Counter()
+
+    def log_delta(self, previous: tuple, log: Log) -> Log:
+        """Turns a full log that only grew since `previous` into an append."""
+        if previous is None or len(log.content) <= previous[0]:
+            return log
+
+        length = previous[0]
+        if hash(log.content[max(length - FINGERPRINT_TAIL, 0):length]) != previous[1]:
+            return log
+
+        return Log(content=log.content[length:], append=True)
+
+    def filter(self, signal: dict) -> dict:
+        changes = {}
+        for url, snapshot in signal.items():
+            changed = {}
+            for field, value in snapshot.items():
+                if field == 'log' and value.append:
+                    # The whole log isn't known here anymore
+                    self._fingerprints.pop((url, field), None)
+                    is_changed = bool(value.content)
+                else:
+                    current = fingerprint(field, value)
+                    previous = self._fingerprints.get((url, field))
+                    is_changed = previous != current
+                    self._fingerprints[(url, field)] = current
+                    if field == 'log' and is_changed:
+                        value = self.log_delta(previous, value)
+
+                if is_changed:
+                    changed[field] = value
+                    self.updated[field] += 1
+                else:
+                    self.skipped[field] += 1
+
+            if changed:
+                changes[url] = changed
+
+        return changes
 
 
 class MainWindow(QMainWindow):
@@ -52,30 +406,77 @@ class MainWindow(QMainWindow):
         self._logger = logging.getLogger('index')
         self.pageList = ['homePage', 'logsPage']
 
+        # Renders charts off the GUI thread with CHART_BACKEND=worker
+        self._render_thread = QThread()
+        self.renderer = ChartRenderer()
+        self.renderer.moveToThread(self._render_thread)
+
+        # Streams log downloads to disk
+        self._export_thread = QThread()
+        self.exporter = LogExporter()
+        self.exporter.moveToThread(self._export_thread)
+        self.exporting = False
+        self.closed = False
+
         self.initUi()
 
         self._thread = QThread()
 
-        self.get_handler = GetHandler()
+        self.get_handler = CollectorHandler() if COLLECTOR == 'process' else GetHandler()
         self.get_handler.done.connect(self.onRequestReady)
 
-        self.post_handler = PostHandler()
-
-        self.post_handler.moveToThread(self._thread)
         self.get_handler.moveToThread(self._thread)
+        self._thread.started.connect(self.get_handler.start)
+
+        # Commands have their own thread, a slow command never holds up polling
+        self._command_thread = QThread()
+        self.post_handler = PostHandler()
+        self.post_handler.done.connect(self.onCommandDone)
+        self.post_handler.moveToThread(self._command_thread)
+        self._command_thread.started.connect(self.post_handler.serve)
 
-        self._thread.started.connect(self.get_handler.loop)
+        self.latency_log = MetricHistory()
+        self.memory_usage_log = MetricHistory()
+        self.downsampler = Downsampler()
+        self.changes = ChangeDetector()
 
-        self.latency_log = [-2 for _ in range(10)]
-        self.memory_usage_log = [-2 for _ in range(10)]
+        # Latest status and vars of every instance
+        self.instances = {url: {} for url in APPLICATION_URLS}
 
         self._thread.start()
+        self._command_thread.start()
+        self._export_thread.start()
+        if CHART_BACKEND == 'worker':
+            self._render_thread.start()
 
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
         self._logger.info('Closing MainWindow')
+        self._logger.info(f'Widget updates: {dict(self.changes.updated)}, '
+                          f'skipped as unchanged: {dict(self.changes.skipped)}')
+        self.closed = True
+        self.get_handler.stop()
+        if not self._thread.wait(int(SHUTDOWN_TIMEOUT * 1000)):
+            self._logger.warning('Poller did not stop in time')
+        self._render_thread.quit()
+        self._render_thread.wait()
+        self.exporter.cancel()
+        self._export_thread.quit()
+        self._export_thread.wait()
+        self.post_handler.stop()
+        self._command_thread.quit()
+        if not self._command_thread.wait(int(SHUTDOWN_TIMEOUT * 1000)):
+            self._logger.warning('Command sender did not stop in time')
+        for model in self.logs.values():
+            if model.archive is not None:
+                model.archive.close()
         super().closeEvent(event)
         self._logger.info('MainWindow has been successfully closed')
 
+    def changeEvent(self, event: QtCore.QEvent) -> None:
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.get_handler.setBackground(self.isMinimized())
+        super().changeEvent(event)
+
     def initUi(self):
         self._logger.info('Initializing MainWindow\'s UI')
 
@@ -87,6 +488,50 @@ class MainWindow(QMainWindow):
         for i in ['launch', 'terminate', 'restart']:
             eval(f'self.{i}').clicked.connect(self.onControlBtnClick)
 
+        # Instance selection
+        self.instance.addItem('All instances', None)
+        for url in APPLICATION_URLS:
+            self.instance.addItem(self.instanceName(url), url)
+        self.instance.setVisible(len(APPLICATION_URLS) > 1)
+        self.instance.currentIndexChanged.connect(self.onInstanceChanged)
+
+        # Logs, one model per instance, the view shows the selected one,
+        # archived history included
+        self.logs = {url: LogModel(archive=open_archive(url), parent=self) for url in APPLICATION_URLS}
+        self.logger.setModel(self.logs[self.logInstance()])
+
+        # Log search
+        self.search.textChanged.connect(self.onSearch)
+        self.regex.toggled.connect(self.onSearch)
+        self.search.returnPressed.connect(self.onSearchNext)
+
+        # Log download
+        self.download.clicked.connect(self.onDownloadClick)
+        self.exporter.progress.connect(self.onExportProgress)
+        self.exporter.finished.connect(self.onExportDone)
+        self.exporter.failed.connect(self.onExportDone)
+
+        # Log filters
+        for checkbox in [self.level_info, self.level_warning, self.level_error, self.time_filter]:
+            checkbox.toggled.connect(self.onFilterChanged)
+        for edit in [self.since, self.until]:
+            edit.dateTimeChanged.connect(self.onFilterChanged)
+
+        # Charts
+        self.zoom.addItem('Live', 'raw')
+        for name in ROLLUP_RESOLUTIONS:
+            self.zoom.addItem(f'Peak per {name}', name)
+        self.zoom.currentIndexChanged.connect(self.updateCharts)
+
+        if CHART_BACKEND == 'matplotlib':
+            self.memory = self.replaceWidget(self.memory, MplBarChart())
+            self.latency = self.replaceWidget(self.latency, MplBarChart())
+        elif CHART_BACKEND == 'worker':
+            self.memory = self.replaceWidget(self.memory, ImageChart(self.renderer, 'memory'))
+            self.latency = self.replaceWidget(self.latency, ImageChart(self.renderer, 'latency'))
+        self.memory.setMaximum(512)
+        self.latency.setMaximum(0.5)
+
         # Window controls
         self.close_btn.clicked.connect(self.close)
         self.minimize_btn.clicked.connect(self.showMinimized)
@@ -100,6 +545,16 @@ class MainWindow(QMainWindow):
 
         self._logger.info('Initialized UI, starting application...')
 
+    @staticmethod
+    def replaceWidget(old: QWidget, new: QWidget) -> QWidget:
+        new.setObjectName(old.objectName())
+        new.setMinimumSize(old.minimumSize())
+        new.setMaximumSize(old.maximumSize())
+        old.parentWidget().layout().replaceWidget(old, new)
+        old.hide()
+        old.deleteLater()
+        return new
+
     def maximizeEvent(self):
         if self.isMaximized():
             self.centralWidget().setStyleSheet(
@@ -132,85 +587,237 @@ class MainWindow(QMainWindow):
         self.dragPos = event.globalPos()
 
     def onRequestReady(self, signal: dict):
-        if signal is None:
+        # Snapshots queued before the poller stopped may arrive after close
+        if signal is None or self.closed:
+            return
+
+        signal = self.changes.filter(signal)
+        for url, snapshot in signal.items():
+            if 'log' in snapshot:
+                self.updateLogs(url, snapshot['log'])
+
+            state = self.instances[url]
+            state.update((k, v) for k, v in snapshot.items() if k != 'log')
+
+        # Summaries of several instances include their vars
+        summary_fields = {'status', 'vars'} if len(self.instances) > 1 else {'status'}
+        if any(summary_fields & snapshot.keys() for snapshot in signal.values()):
+            self.updateStatus()
+        # Instances going unreachable or coming back change the totals too
+        if any({'status', 'vars'} & snapshot.keys() for snapshot in signal.values()):
+            self.updateVars()
+        else:
+            self.repeatVars()
+
+    @staticmethod
+    def instanceName(url: str) -> str:
+        return urlparse(url).netloc or url
+
+    def logInstance(self) -> str:
+        """Instance whose log is shown, the first one if all are selected."""
+        return self.instance.currentData() or APPLICATION_URLS[0]
+
+    def onInstanceChanged(self):
+        self.logger.setModel(self.logs[self.logInstance()])
+        self.onFilterChanged()
+        self.onSearch()
+
+    def onFilterChanged(self):
+        boxes = [self.level_info, self.level_warning, self.level_error]
+        levels = set()
+        if self.level_info.isChecked():
+            levels |= {logging.NOTSET, logging.DEBUG, logging.INFO}
+        if self.level_warning.isChecked():
+            levels.add(logging.WARNING)
+        if self.level_error.isChecked():
+            levels |= {logging.ERROR, logging.CRITICAL}
+
+        model: LogModel = self.logger.model()
+        timed = self.time_filter.isChecked()
+        if timed and not self.since.isEnabled() and len(model.store):
+            # Start from the whole log, blocking the edits' own signals
+            for edit, seconds in [(self.since, model.store.times[0]), (self.until, model.store.times[-1])]:
+                edit.blockSignals(True)
+                edit.setDateTime(QtCore.QDateTime.fromSecsSinceEpoch(int(seconds), Qt.UTC))
+                edit.blockSignals(False)
+        self.since.setEnabled(timed)
+        self.until.setEnabled(timed)
+
+        model.setFilter(
+            levels=None if all(box.isChecked() for box in boxes) else levels,
+            since=self.secondsOf(self.since.dateTime()) if timed else None,
+            until=self.secondsOf(self.until.dateTime()) if timed else None
+        )
+        self.logger.setProperty('follow', True)
+        self.logger.scrollToBottom()
+        self.onSearch()
+
+    @staticmethod
+    def secondsOf(value: QtCore.QDateTime) -> int:
+        """Seconds since the epoch of a naive time, as log lines are timed."""
+        return QtCore.QDateTime(value.date(), value.time(), Qt.UTC).toSecsSinceEpoch()
+
+    def searchLog(self) -> list:
+        """Rows of the shown log matching the search box, highlighting them."""
+        query = self.search.text()
+        if not query:
+            self.logger.setHighlight(None)
+            self.matches.clear()
+            return []
+
+        try:
+            pattern = compile_query(query, self.regex.isChecked())
+            model: LogModel = self.logger.model()
+            rows, truncated = model.search_index.search(query, self.regex.isChecked())
+            rows = model.viewRows(rows)
+        except re.error:
+            self.logger.setHighlight(None)
+            self.matches.setText('Invalid regex')
+            return []
+
+        self.logger.setHighlight(pattern)
+        self.matches.setText(f'{len(rows)}{"+" if truncated else ""} matches')
+        return rows
+
+    def onSearch(self):
+        self.searchLog()
+
+    def onSearchNext(self):
+        """Selects the match above the selected line, wrapping to the last one."""
+        rows = self.searchLog()
+        if not rows:
             return
 
-        self.updateLogs(signal)
-        self.updateStatus(signal)
-        self.updateVars(signal)
+        current = self.logger.currentIndex()
+        current = current.row() if current.isValid() else self.logger.model().rowCount()
+        i = bisect.bisect_left(rows, current) - 1
+        row = rows[i]
+        self.matches.setText(f'{(i % len(rows)) + 1} of {self.matches.text()}')
+
+        # Stop following the bottom, the match would scroll away
+        self.logger.setProperty('follow', False)
+        self.logger.selectRow(row)
+        self.logger.scrollTo(self.logger.model().index(row), QAbstractItemView.PositionAtCenter)
 
-    def updateVars(self, signal: dict):
-        vars_: Vars = signal['vars']
-        data = json.loads(vars_.json())
-        cpu, servers, memory = data.values()
-        memory = float(memory[:-1])
+    def updateVars(self):
+        vars_ = [vars_ for vars_ in map(self.liveVars, self.instances.values()) if vars_]
+        servers = sum(v.servers for v in vars_)
+        memory = sum(float(v.memory_used[:-1]) for v in vars_)
+        cpu = sum(v.cpu_used for v in vars_) / len(vars_) if vars_ else 0.0
 
         self.servers.setText(f'Servers: {servers}')
         self.title_mem.setText(f'Memory: {memory:.2f} MB')
         self.title_lat.setText(f'CPU: {cpu:.2f}%')
 
-        del self.memory_usage_log[0]
-        self.memory_usage_log.append(round(memory, 2))
-
-        del self.latency_log[0]
-        self.latency_log.append(round(cpu, 2))
-
-        # Memory usage chart
-        fig: plt.Figure = plt.figure(figsize=(4, 4))
-        y = self.memory_usage_log
-        x = list(range(10))
-        plt.bar(x, y, width=0.9, color='#bfbf01')
-        plt.xticks(x)
-        plt.ylim([0, 512])
-        plt.margins(0.015, tight=True)
-        plt.tight_layout()
-        buffer = io.BytesIO()
-        fig.savefig(buffer, format='png')
-        plt.close(fig)
-
-        img = Image.open(buffer, formats=['png'])
-        img = img.resize((CHART_WIDTH, CHART_WIDTH))
-        pixmap = self.convertImage(img)
-        self.memory.setPixmap(pixmap)
-
-        # Latency changes chart
-        fig: plt.Figure = plt.figure(figsize=(4, 4))
-        y = self.latency_log
-        x = list(range(10))
-        plt.bar(x, y, width=0.9, color='#bfbf01')
-        plt.xticks(x)
-        plt.ylim([0, 0.5])
-        plt.margins(0.015, tight=True)
-        plt.tight_layout()
-        buffer = io.BytesIO()
-        fig.savefig(buffer, format='png')
-        plt.close(fig)
-
-        img = Image.open(buffer, formats=['png'])
-        img = img.resize((CHART_WIDTH, CHART_WIDTH))
-        pixmap = self.convertImage(img)
-        self.latency.setPixmap(pixmap)
+        # No sample rather than a fake zero while no instance is reachable
+        self.memory_usage_log.append(round(memory, 2) if vars_ else float('nan'))
+        self.latency_log.append(round(cpu, 2) if vars_ else float('nan'))
+
+        self.updateCharts()
+
+    def repeatVars(self):
+        """Samples unchanged totals into the rollups, every cycle counts for their buckets."""
+        self.memory_usage_log.repeat()
+        self.latency_log.repeat()
+        if self.zoom.currentData() != 'raw':
+            self.updateCharts()
+
+    def updateCharts(self):
+        # Live shows the latest CHART_SAMPLES samples, rollups all their buckets
+        # (showing the peak of each), both fit to the chart width
+        zoom = self.zoom.currentData()
+        samples = (CHART_SAMPLES or None) if zoom == 'raw' else None
+        for chart, history in [(self.memory, self.memory_usage_log),
+                               (self.latency, self.latency_log)]:
+            width = max(chart.width() // MIN_BAR_WIDTH, 3)
+            chart.setValues(self.downsampler.values(history.buffer(zoom), width, samples))
+
+    def updateLogs(self, url: str, log: Log):
+        archive = self.logs[url].archive
+        if archive is not None:
+            try:
+                archive.write(log)
+            except OSError as e:
+                self._logger.warning(f'Failed archiving log of {url}: {e}')
+
+        if log.append:
+            self.logs[url].appendText(log.content)
+        else:
+            self.logs[url].setText(log.content)
 
     @staticmethod
-    def convertImage(im):
-        im2 = im.convert('RGBA')
-        data = im2.tobytes('raw', 'RGBA')
-        qim = QImage(data, im.size[0], im.size[1], QImage.Format_ARGB32)
-        pixmap = QPixmap.fromImage(qim)
-        return pixmap
-
-    def updateLogs(self, signal: dict):
-        self.logger.setPlainText(signal['log'].content)
-        self.logger.moveCursor(QtGui.QTextCursor.End)
-
-    def updateStatus(self, signal: dict):
-        self.status.setText(
-            f'Bot status:\n{signal["status"]}'
-        )
+    def liveVars(state: dict) -> Optional[Vars]:
+        """Latest vars of an instance, None while it is unreachable."""
+        if state.get('status', 'unknown') == 'unknown':
+            return None
+        return state.get('vars')
+
+    def updateStatus(self):
+        if len(self.instances) == 1:
+            state, = self.instances.values()
+            self.status.setText(
+                f'Bot status:\n{state.get("status", "unknown")}'
+            )
+            return
+
+        lines = []
+        for url, state in self.instances.items():
+            line = f'{self.instanceName(url)}: {state.get("status", "unknown")}'
+            vars_ = self.liveVars(state)
+            if vars_ is not None:
+                line += (f', {vars_.servers} servers, {vars_.cpu_used:.2f}% CPU,'
+                         f' {float(vars_.memory_used[:-1]):.0f} MB')
+            lines.append(line)
+
+        self.status.setText('Bot status:\n' + '\n'.join(lines))
+
+    def onDownloadClick(self):
+        if self.exporting:
+            self.exporter.cancel()
+            return
+
+        url = self.logInstance()
+        name = f'{self.instanceName(url)}-{time.strftime("%Y%m%d-%H%M%S")}.log'.replace(':', '_')
+        path, chosen = QFileDialog.getSaveFileName(self, 'Download log', name, ';;'.join(file_filters()))
+        if not path:
+            return
+
+        # The chosen format's extension, unless a compressed one was typed
+        extension = chosen[chosen.index('*') + 1:-1]
+        if not path.endswith(('.gz', '.zst', extension)):
+            path = re.sub(r'\.log$', '', path) + extension
+
+        # The archive holds the whole log, the lines in memory included
+        model: LogModel = self.logs[url]
+        total, chunks = archive_chunks(model.archive) if model.archive is not None \
+            else store_chunks(model.store)
+
+        self.exporting = True
+        self.download.setText('Cancel download')
+        self.download_progress.setValue(0)
+        self.download_progress.setVisible(True)
+        self.exporter.start(total, chunks, path)
+
+    def onExportProgress(self, written: int, total: int):
+        self.download_progress.setValue(written * 1000 // max(total, 1))
+
+    def onExportDone(self, result: str):
+        self.exporting = False
+        self.download.setText('Download log')
+        self.download_progress.setVisible(False)
 
     def onControlBtnClick(self):
         instruction = self.sender().objectName()
-        self.post_handler.post(instruction)
+        self.post_handler.post(instruction, self.instance.currentData())
+
+    def onCommandDone(self, result: CommandResult):
+        message = (f'{result.instruction} on {self.instanceName(result.instance)}: '
+                   f'{result.status_code or result.error} in {result.elapsed * 1000:.0f} ms'
+                   f' (queued {result.waited * 1000:.0f} ms, {result.merged} merged)')
+        if result.ok:
+            self._logger.info(message)
+        else:
+            self._logger.warning(message)
 
     def onNavChecked(self):
         page = self.sender().objectName() + 'Page'
@@ -229,6 +836,8 @@ if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(name)s:\t%(message)s',
                         datefmt='%y.%b.%Y %H:%M:%S')
+    if not APPLICATION_URLS:
+        sys.exit('No bot to monitor: set APPLICATION_URLS to a comma-separated list of bot URLs')
 
     app = QApplication([])
     QFontDatabase.addApplicationFont('sources/fonts/Montserrat-Regular.ttf')
@@ -0,0 +1,208 @@
+import os
+import re
+from typing import List, Tuple
+
+import numpy as np
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Lines per index block, a block is the unit of candidate filtering
+BLOCK_LINES = int(os.environ.get('SEARCH_BLOCK_LINES', 1024))
+# Matches returned per query, the newest ones
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 1000))
+# Bits of the trigram hash, each block keeps a bitmap of 2 ** HASH_BITS bits
+HASH_BITS = 16
+
+_REQUIRED = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+             getattr(sre_parse, 'POSSESSIVE_REPEAT', sre_parse.MAX_REPEAT))
+
+
+def _lower(data: np.ndarray) -> np.ndarray:
+    """ASCII lowercase of UTF-8 bytes, other bytes are kept as they are."""
+    upper = (data >= 65) & (data <= 90)
+    return data + upper.astype(np.uint8) * 32
+
+
+def trigram_hashes(data: bytes) -> np.ndarray:
+    """Hashes of the case-folded byte trigrams of `data`, with repeats."""
+    chars = _lower(np.frombuffer(data, dtype=np.uint8)).astype(np.uint32)
+    if len(chars) < 3:
+        return np.empty(0, dtype=np.uint32)
+
+    codes = chars[:-2] << 16 | chars[1:-1] << 8 | chars[2:]
+    hashes = (codes.astype(np.uint64) * 0x9E3779B1 & 0xFFFFFFFF) >> (32 - HASH_BITS)
+    return hashes.astype(np.uint32)
+
+
+def compile_query(query: str, regex: bool = False) -> re.Pattern:
+    """A regex as is, anything else as a case-insensitive substring."""
+    return re.compile(query) if regex else re.compile(re.escape(query), re.IGNORECASE)
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Literal strings every match of regex `pattern` contains, possibly none.
+
+    Only runs of literal characters in sequence are taken, anything
+    optional or alternative (`?`, `*`, `|`) contributes nothing.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+
+    literals = []
+
+    def walk(items):
+        run = []
+        for op, av in items:
+            if op == sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+
+            literals.append(''.join(run))
+            run = []
+            if op == sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif op in _REQUIRED and av[0] >= 1:
+                walk(av[2])
+        literals.append(''.join(run))
+
+    walk(parsed)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class LogIndex:
+    """
+    Trigram index over the lines of a `LineStore`.
+
+    Lines are indexed in blocks of BLOCK_LINES, each block keeping a
+    bitmap of the hashed trigrams of its text, case folded. A query only
+    runs its regex over the blocks whose bitmap has all the trigrams of
+    the query's literals, plus the block still being filled, which is
+    not indexed yet. Bitmaps are 8 KiB per block whatever the line
+    length, about a tenth of typical log text.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._bitmaps = np.zeros((16, 2 ** HASH_BITS // 8), dtype=np.uint8)
+        # Absolute line number of the first line of block 0
+        self._first = 0
+        self._count = 0
+
+    def clear(self):
+        self._bitmaps = np.zeros((16, 2 ** HASH_BITS // 8), dtype=np.uint8)
+        self._first = self.store.first
+        self._count = 0
+
+    @property
+    def indexed(self) -> int:
+        """Absolute line number up to which lines are indexed."""
+        return self._first + self._count * BLOCK_LINES
+
+    def update(self):
+        """Indexes the blocks of lines completed since the last update."""
+        store = self.store
+        # Drop blocks whose lines were all trimmed from the store
+        dropped = (store.first - self._first) // BLOCK_LINES
+        if dropped > 0:
+            dropped = min(dropped, self._count)
+            self._bitmaps[:self._count - dropped] = self._bitmaps[dropped:self._count]
+            self._count -= dropped
+            self._first += dropped * BLOCK_LINES
+
+        complete = store.first + len(store) - store.partial
+        while self.indexed + BLOCK_LINES <= complete:
+            start = max(self.indexed - store.first, 0)
+            end = self.indexed + BLOCK_LINES - store.first
+            self._add(trigram_hashes(store.text(start, end)))
+
+    def _add(self, hashes: np.ndarray):
+        if self._count == len(self._bitmaps):
+            grown = np.zeros((2 * len(self._bitmaps), self._bitmaps.shape[1]), dtype=np.uint8)
+            grown[:self._count] = self._bitmaps[:self._count]
+            self._bitmaps = grown
+
+        bits = np.zeros(2 ** HASH_BITS, dtype=bool)
+        bits[hashes] = True
+        self._bitmaps[self._count] = np.packbits(bits, bitorder='little')
+        self._count += 1
+
+    def _candidates(self, literals: List[str]) -> np.ndarray:
+        """Indices of the indexed blocks that may contain all `literals`."""
+        # Only ASCII is case folded, so non-ASCII parts can't narrow down
+        parts = [part for literal in literals for part in re.split(r'[^\x00-\x7f]+', literal)]
+        hashes = np.unique(np.concatenate(
+            [trigram_hashes(part.encode()) for part in parts] or [[]]
+        ).astype(np.uint32))
+        bitmaps = self._bitmaps[:self._count]
+        if not len(hashes):
+            return np.arange(self._count)
+
+        masks = (1 << (hashes & 7)).astype(np.uint8)
+        present = bitmaps[:, hashes >> 3] & masks
+        return np.flatnonzero(present.all(axis=1))
+
+    @staticmethod
+    def _match_lines(text: str, start: int, pattern: re.Pattern, whole: re.Pattern) -> list:
+        matched = []
+        row, pos, counted = start, 0, 0
+        while True:
+            match = whole.search(text, pos)
+            if match is None:
+                return matched
+
+            begin = text.rfind('\n', 0, match.start()) + 1
+            end = text.find('\n', match.start())
+            end = len(text) if end < 0 else end
+            row += text.count('\n', counted, begin)
+            counted = begin
+            if pattern.search(text[begin:end]):
+                matched.append(row)
+            pos = end + 1
+
+    def search(self, query: str, regex: bool = False, limit: int = SEARCH_LIMIT) -> Tuple[list, bool]:
+        """
+        Rows of the store matching `query`, a case-insensitive substring
+        or a regex, and whether more than `limit` rows matched, in which
+        case the newest `limit` are returned. Regexes match single lines.
+        Raises `re.error` for an invalid regex.
+        """
+        pattern = compile_query(query, regex)
+        literals = required_literals(query) if regex else [query]
+        self.update()
+
+        store = self.store
+        ranges = [(self.indexed - store.first, len(store))]
+        ranges += [(self._first + block * BLOCK_LINES - store.first,
+                    self._first + (block + 1) * BLOCK_LINES - store.first)
+                   for block in self._candidates(literals)[::-1]]
+
+        # Blocks are searched as a whole (multiline, `\A` and `\Z` would
+        # not carry over), jumping from match to match and checking only
+        # the lines a match starts on
+        anchored = '\\A' in query or '\\Z' in query
+        whole = None if anchored else re.compile(pattern.pattern, pattern.flags | re.MULTILINE)
+
+        chunks, found = [], 0
+        for start, end in ranges:
+            start = max(start, 0)
+            if start >= end:
+                continue
+
+            text = store.text(start, end).decode(errors='replace')
+            if whole is None:
+                matched = [start + i for i, line in enumerate(text.split('\n'))
+                           if pattern.search(line)]
+            else:
+                matched = self._match_lines(text, start, pattern, whole)
+            chunks.append(matched)
+            found += len(matched)
+            if found > limit:
+                break
+
+        rows = [row for matched in reversed(chunks) for row in matched]
+        return rows[-limit:], found > limit
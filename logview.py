@@ -0,0 +1,453 @@
+import os
+import re
+import threading
+from typing import Optional
+
+import numpy as np
+from PyQt5.QtCore import QAbstractListModel, QEvent, QModelIndex, QRect, Qt
+from PyQt5.QtGui import QColor, QKeySequence, QPainter, QPalette
+from PyQt5.QtWidgets import (QAbstractItemView, QAbstractScrollArea, QApplication, QHeaderView,
+                             QStyle, QStyledItemDelegate, QStyleOptionViewItem, QTableView)
+
+from logfields import fill_forward, parse_fields
+from logsearch import LogIndex
+
+# Lines kept per log, older ones are dropped from the top
+LOG_MAX_LINES = int(os.environ.get('LOG_MAX_LINES', 5_000_000))
+HIGHLIGHT_COLOR = '#ffe761'
+# Lines whose level and time are parsed at once
+PARSE_BATCH = 65536
+
+
+class LineStore:
+    """
+    Log lines as one UTF-8 buffer plus numpy arrays of line start offsets,
+    levels and timestamps.
+
+    Costs the raw bytes plus 13 bytes per line, lines are only decoded
+    when asked for, their level and time are parsed once on `append`.
+    A last line without its newline yet is continued by the next `append`.
+    """
+    def __init__(self):
+        # Held while bytes move, `read` may be called from other threads
+        self._lock = threading.Lock()
+        # Bytes trimmed so far and number of `clear`s, for `read`
+        self._dropped = 0
+        self._buffer = bytearray()
+        self.resets = 0
+        self.clear()
+
+    def __len__(self) -> int:
+        if not self._buffer:
+            return 0
+
+        return self._count - (self._buffer[-1] == 10)
+
+    @property
+    def partial(self) -> bool:
+        """Whether the last line is still waiting for its newline."""
+        return bool(self._buffer) and self._buffer[-1] != 10
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buffer) + self._starts.nbytes + self._levels.nbytes + self._times.nbytes
+
+    @property
+    def levels(self) -> np.ndarray:
+        """Logging level of every line, of the previous line for lines without one."""
+        return self._levels[:len(self)]
+
+    @property
+    def times(self) -> np.ndarray:
+        """Timestamp of every line in seconds, naive local time, like `levels`."""
+        return self._times[:len(self)]
+
+    def length_after(self, data: bytes) -> int:
+        """Number of lines there would be after appending `data`."""
+        if not data:
+            return len(self)
+
+        newlines = self._count - 1 if self._buffer else 0
+        return newlines + data.count(b'\n') + (data[-1] != 10)
+
+    def append(self, data: bytes):
+        if not data:
+            return
+
+        base = len(self._buffer)
+        # Resizing fails while `read` has the buffer exported
+        with self._lock:
+            self._buffer += data
+        starts = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + (base + 1)
+        if base == 0:
+            starts = np.concatenate(([0], starts))
+
+        needed = self._count + len(starts)
+        if needed > len(self._starts):
+            size = max(needed, 2 * len(self._starts))
+            self._starts, self._levels, self._times = (
+                np.concatenate((array[:self._count], np.zeros(size - self._count, dtype=array.dtype)))
+                for array in (self._starts, self._levels, self._times)
+            )
+        self._starts[self._count:needed] = starts
+
+        # The line that was being continued is parsed again with its new bytes
+        first = max(self._count - 1, 0)
+        self._count = needed
+        self._parse(first, needed)
+
+    def _parse(self, first: int, end: int):
+        # In batches, parsing builds arrays of tens of bytes per line
+        data = np.frombuffer(self._buffer, dtype=np.uint8)
+        for batch in range(first, end, PARSE_BATCH):
+            stop = min(batch + PARSE_BATCH, end)
+            starts = self._starts[batch:stop]
+            after = self._starts[stop] if stop < end else len(self._buffer) + 1
+            stops = np.append(self._starts[batch + 1:stop], after) - 1
+            levels, times, valid = parse_fields(data, starts, stops)
+            previous = batch - 1
+            self._levels[batch:stop] = fill_forward(levels, valid, self._levels[previous] if previous >= 0 else 0)
+            self._times[batch:stop] = fill_forward(times, valid, self._times[previous] if previous >= 0 else 0)
+
+    def clear(self):
+        with self._lock:
+            self._dropped += len(self._buffer)
+            self.resets += 1
+            self._buffer = bytearray()
+        self._starts = np.zeros(1024, dtype=np.int64)
+        self._levels = np.zeros(1024, dtype=np.uint8)
+        self._times = np.zeros(1024, dtype=np.uint32)
+        self._count = 0
+        # Lines trimmed so far, the absolute line number of row 0
+        self.first = 0
+
+    def trim(self, lines: int):
+        """Drops the first `lines` lines."""
+        cut = int(self._starts[lines])
+        with self._lock:
+            del self._buffer[:cut]
+            self._dropped += cut
+        self._count -= lines
+        self._starts[:self._count] = self._starts[lines:lines + self._count] - cut
+        self._levels[:self._count] = self._levels[lines:lines + self._count]
+        self._times[:self._count] = self._times[lines:lines + self._count]
+        self.first += lines
+
+    @property
+    def size(self) -> int:
+        """Bytes of text held."""
+        return len(self._buffer)
+
+    @property
+    def end(self) -> int:
+        """Position after the last byte, counting the bytes trimmed so far."""
+        return self._dropped + len(self._buffer)
+
+    def read(self, position: int, size: int, resets: int) -> tuple:
+        """
+        Thread-safe, up to `size` bytes from `position`, counted like `end`,
+        and the position after them. Bytes trimmed meanwhile are skipped,
+        nothing is returned once the store was cleared since `resets`.
+        """
+        with self._lock:
+            if self.resets != resets:
+                return b'', position
+
+            start = max(position - self._dropped, 0)
+            data = bytes(memoryview(self._buffer)[start:start + size])
+            return data, self._dropped + start + len(data)
+
+    def span(self, row: int) -> tuple:
+        """Byte range of line `row` in the buffer, without the newline."""
+        start = int(self._starts[row])
+        end = int(self._starts[row + 1]) - 1 if row + 1 < self._count else len(self._buffer)
+        return start, end
+
+    def text(self, start: int, end: int) -> bytes:
+        """Lines `start` to `end` (excluded), joined by newlines."""
+        begin = int(self._starts[start])
+        stop = self.span(end - 1)[1]
+        return bytes(memoryview(self._buffer)[begin:stop])
+
+    def line(self, row: int) -> str:
+        start, end = self.span(row)
+        return self._buffer[start:end].decode(errors='replace')
+
+
+class LogModel(QAbstractListModel):
+    """
+    List model of a `LineStore`, keeping at most `max_lines` lines.
+
+    With a filter set only the matching lines are rows, kept as an array
+    of store rows that is rebuilt from masks over the store's level and
+    time arrays, and extended with the matching new lines on append.
+
+    Given the `archive` the same log is written to, the archived lines
+    older than the store are rows above it, read from disk. Lines
+    trimmed from the store then stay rows, read from the archive too.
+    Filters and search only cover the lines in memory.
+    """
+    def __init__(self, max_lines: int = LOG_MAX_LINES, archive=None, parent=None):
+        super(LogModel, self).__init__(parent)
+        self.archive = archive
+        self.store = LineStore()
+        self.search_index = LogIndex(self.store)
+        self.max_lines = max_lines
+        # Logging levels shown, all if None, and time range in seconds
+        self.levels = None
+        self.since = None
+        self.until = None
+        # Store rows shown while filtered, None while not
+        self._rows = None
+        # Archived rows shown above the store while not filtered
+        self._history = self._archived()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+
+        return self._history + len(self.store) if self._rows is None else len(self._rows)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.line(index.row())
+
+        return None
+
+    def line(self, row: int) -> str:
+        if self._rows is not None:
+            return self.store.line(int(self._rows[row]))
+        if row < self._history:
+            return self.archive.line(self.archive.first + row)
+
+        return self.store.line(row - self._history)
+
+    def _archived(self) -> int:
+        """Number of archived lines older than the store."""
+        if self.archive is None:
+            return 0
+
+        return max(self.archive.end - self.archive.first - len(self.store), 0)
+
+    def viewRows(self, rows: list) -> list:
+        """Rows showing the store rows `rows`, of those that are shown."""
+        if self._rows is None:
+            return [row + self._history for row in rows]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.searchsorted(self._rows, rows)
+        shown = positions < len(self._rows)
+        shown[shown] = self._rows[positions[shown]] == rows[shown]
+        return positions[shown].tolist()
+
+    def setFilter(self, levels: Optional[set] = None, since: Optional[int] = None, until: Optional[int] = None):
+        """Shows only lines of `levels`, timed from `since` to `until` included."""
+        self.beginResetModel()
+        self.levels, self.since, self.until = levels, since, until
+        filtered = levels is not None or since is not None or until is not None
+        self._rows = np.flatnonzero(self._matching(0, len(self.store))) if filtered else None
+        self.endResetModel()
+
+    def _matching(self, start: int, end: int) -> np.ndarray:
+        mask = np.ones(end - start, dtype=bool)
+        if self.levels is not None:
+            allowed = np.zeros(256, dtype=bool)
+            allowed[list(self.levels)] = True
+            mask &= allowed[self.store.levels[start:end]]
+        if self.since is not None:
+            mask &= self.store.times[start:end] >= self.since
+        if self.until is not None:
+            mask &= self.store.times[start:end] <= self.until
+        return mask
+
+    def appendText(self, text: str):
+        data = text.encode()
+        if self._rows is None:
+            self._append(data)
+        else:
+            self._appendFiltered(data)
+
+        # Trim in batches, dropping lines shifts the whole buffer
+        if len(self.store) > self.max_lines * 1.1:
+            excess = len(self.store) - self.max_lines
+            if self._rows is None and self.archive is not None:
+                # Trimmed lines are the next archived ones, the rows stay the same
+                self.store.trim(excess)
+                self._history += excess
+            else:
+                removed = excess if self._rows is None else int(np.searchsorted(self._rows, excess))
+                if removed:
+                    self.beginRemoveRows(QModelIndex(), 0, removed - 1)
+                self.store.trim(excess)
+                if self._rows is not None:
+                    self._rows = self._rows[removed:] - excess
+                if removed:
+                    self.endRemoveRows()
+
+        self._syncHistory()
+        self.search_index.update()
+
+    def _syncHistory(self):
+        """Drops rows of archived lines that retention removed from the archive."""
+        history = self._archived()
+        dropped = self._history - history
+        if dropped > 0 and self._rows is None:
+            self.beginRemoveRows(QModelIndex(), 0, dropped - 1)
+            self._history = history
+            self.endRemoveRows()
+        elif dropped < 0 and self._rows is None:
+            self.beginInsertRows(QModelIndex(), 0, -dropped - 1)
+            self._history = history
+            self.endInsertRows()
+        self._history = history
+
+    def _append(self, data: bytes):
+        rows, after = len(self.store), self.store.length_after(data)
+        continued = bool(data) and self.store.partial
+        history = self._history
+
+        if after > rows:
+            self.beginInsertRows(QModelIndex(), history + rows, history + after - 1)
+        self.store.append(data)
+        if after > rows:
+            self.endInsertRows()
+        if continued:
+            self.dataChanged.emit(self.index(history + rows - 1), self.index(history + rows - 1))
+
+    def _appendFiltered(self, data: bytes):
+        if not data:
+            return
+
+        # A continued line is matched again, its level may only be known now
+        start = len(self.store) - self.store.partial
+        continued = len(self._rows) and self._rows[-1] == start
+        if continued:
+            self.beginRemoveRows(QModelIndex(), len(self._rows) - 1, len(self._rows) - 1)
+            self._rows = self._rows[:-1]
+            self.endRemoveRows()
+
+        self.store.append(data)
+        added = np.flatnonzero(self._matching(start, len(self.store))) + start
+        if len(added):
+            rows = len(self._rows)
+            self.beginInsertRows(QModelIndex(), rows, rows + len(added) - 1)
+            self._rows = np.concatenate((self._rows, added))
+            self.endInsertRows()
+
+    def setText(self, text: str):
+        self.beginResetModel()
+        self.store.clear()
+        self.store.append(text.encode())
+        self.search_index.clear()
+        self.search_index.update()
+        self._history = self._archived()
+        if self._rows is not None:
+            self._rows = np.flatnonzero(self._matching(0, len(self.store)))
+        self.endResetModel()
+
+
+class HighlightDelegate(QStyledItemDelegate):
+    """Paints log lines as plain text, matches of `pattern` highlighted."""
+    def __init__(self, parent=None):
+        super(HighlightDelegate, self).__init__(parent)
+        self.pattern = None
+        self._color = QColor(HIGHLIGHT_COLOR)
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        option = QStyleOptionViewItem(option)
+        self.initStyleOption(option, index)
+        text, option.text = option.text, ''
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget)
+
+        rect = style.subElementRect(QStyle.SE_ItemViewItemText, option, option.widget)
+        margin = style.pixelMetric(QStyle.PM_FocusFrameHMargin, None, option.widget) + 1
+        rect.adjust(margin, 0, -margin, 0)
+        metrics = option.fontMetrics
+
+        painter.save()
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                start, end = match.span()
+                if start == end:
+                    continue
+
+                x = rect.left() + metrics.size(Qt.TextExpandTabs, text[:start]).width()
+                width = metrics.size(Qt.TextExpandTabs, text[start:end]).width()
+                painter.fillRect(QRect(x, rect.top(), width, rect.height()), self._color)
+
+        selected = option.state & QStyle.State_Selected
+        painter.setPen(option.palette.color(QPalette.HighlightedText if selected else QPalette.Text))
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter | Qt.TextExpandTabs, text)
+        painter.restore()
+
+
+class LogView(QTableView):
+    """
+    Log viewer showing one line per row, all of the same height.
+
+    A single column table rather than a list view: the table's header
+    keeps fixed-size rows as one span, so neither adding lines nor
+    scrolling walks over all the rows, with a thousand lines or millions.
+    """
+    def __init__(self, parent=None):
+        super(LogView, self).__init__(parent)
+        self.horizontalHeader().hide()
+        self.horizontalHeader().setStretchLastSection(True)
+        rows = self.verticalHeader()
+        rows.hide()
+        rows.setSectionResizeMode(QHeaderView.Fixed)
+        self.setShowGrid(False)
+        self.setWordWrap(False)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setModel(LogModel(parent=self))
+        self.highlighter = HighlightDelegate(self)
+        self.setItemDelegate(self.highlighter)
+        self.fitRows()
+        followBottom(self)
+
+    def fitRows(self):
+        self.verticalHeader().setMinimumSectionSize(0)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 2)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.FontChange:
+            self.fitRows()
+        super().changeEvent(event)
+
+    def setHighlight(self, pattern: Optional[re.Pattern]):
+        self.highlighter.pattern = pattern
+        self.viewport().update()
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Copy):
+            rows = sorted({index.row() for index in self.selectedIndexes()})
+            QApplication.clipboard().setText(
+                '\n'.join(self.model().line(row) for row in rows)
+            )
+            return
+
+        super().keyPressEvent(event)
+
+
+def followBottom(view: QAbstractScrollArea):
+    """
+    Keeps `view` scrolled to the bottom as lines are added, unless the user
+    scrolled up, in which case their position is kept until they scroll
+    back down. Also works while the view is hidden and not laid out.
+    """
+    scrollbar = view.verticalScrollBar()
+    view.setProperty('follow', True)
+
+    def onAction(action: int):
+        # Only scrolling by the user decides, not the view's own adjustments
+        view.setProperty('follow', scrollbar.sliderPosition() >= scrollbar.maximum() - 4)
+
+    def onRangeChanged(minimum: int, maximum: int):
+        if view.property('follow'):
+            scrollbar.setValue(maximum)
+
+    scrollbar.actionTriggered.connect(onAction)
+    scrollbar.rangeChanged.connect(onRangeChanged)
@@ -0,0 +1,234 @@
+import os
+import time
+
+import numpy as np
+
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', 12000))
+# Buckets kept per rollup resolution, a day of 1 minute buckets by default
+ROLLUP_SIZE = int(os.environ.get('ROLLUP_SIZE', 1440))
+ROLLUP_RESOLUTIONS = {'10s': 10, '1m': 60, '10m': 600}
+
+
+class RingBuffer:
+    """
+    Fixed-capacity history of timestamped samples.
+
+    Every sample is written twice, at `i` and `i + capacity`, so the
+    latest `n` samples are always one contiguous slice and `times` and
+    `values` can hand out views instead of copies. Views are read-only
+    and only valid until the next `append`.
+    """
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        self.capacity = capacity
+        self._times = np.full(2 * capacity, np.nan, dtype=np.float64)
+        self._values = np.full(2 * capacity, np.nan, dtype=np.float32)
+        self._next = 0
+        self._size = 0
+        # Increments on every append, lets readers cache derived data
+        self.version = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, value: float, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        i = self._next
+        self._times[i] = self._times[i + self.capacity] = timestamp
+        self._values[i] = self._values[i + self.capacity] = value
+
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self.version += 1
+
+    def update_last(self, value: float, timestamp: float = None):
+        """Overwrites the latest sample, e.g. a bucket still being filled."""
+        if not self._size:
+            self.append(value, timestamp)
+            return
+
+        i = (self._next - 1) % self.capacity
+        if timestamp is not None:
+            self._times[i] = self._times[i + self.capacity] = timestamp
+        self._values[i] = self._values[i + self.capacity] = value
+        self.version += 1
+
+    def _window(self, array: np.ndarray, n: int = None) -> np.ndarray:
+        n = self._size if n is None else min(n, self._size)
+        end = self._next + self.capacity
+        view = array[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def times(self, n: int = None) -> np.ndarray:
+        """Timestamps of the latest `n` samples (all by default), oldest first."""
+        return self._window(self._times, n)
+
+    def values(self, n: int = None) -> np.ndarray:
+        """Values of the latest `n` samples (all by default), oldest first."""
+        return self._window(self._values, n)
+
+    @property
+    def last(self) -> float:
+        return float(self._values[self._next - 1 + self.capacity]) if self._size else float('nan')
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Indices of `n` points of (x, y) picked by Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, of each of the `n - 2` buckets
+    in between, the point forming the largest triangle with the point
+    picked in the previous bucket and the mean of the next bucket, which
+    preserves spikes that plain striding would skip. Only the walk over
+    buckets is a Python loop, everything per point is vectorized.
+    """
+    size = len(y)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket i holds points edges[i]:edges[i + 1], none of them empty
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:edges[-1]], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:edges[-1]], edges[:-1]) / counts
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(n, dtype=np.intp)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+class Downsampler:
+    """Caches downsampled values of ring buffers until they get new samples."""
+    def __init__(self):
+        self._cache = {}
+
+    def values(self, buffer: RingBuffer, width: int, n: int = None) -> np.ndarray:
+        """At most `width` of the latest `n` values of `buffer`, owned by the caller."""
+        state = (buffer.version, width, n)
+        cached = self._cache.get(id(buffer))
+        if cached is not None and cached[0] == state:
+            return cached[1]
+
+        times, values = buffer.times(n), buffer.values(n)
+        result = values[lttb(times, values, width)]
+        result.flags.writeable = False
+        self._cache[id(buffer)] = (state, result)
+        return result
+
+
+class Rollup:
+    """
+    Aggregates samples into buckets of `resolution` seconds and keeps
+    min, max, mean and last of each bucket.
+
+    Updated incrementally on every sample, the bucket being filled is
+    always the latest entry of each buffer, so readers see it too. Means
+    are over samples, so a value that holds is added again every cycle.
+    Buckets without samples held the last value and are filled with it
+    once the next sample arrives, unless `gap` was called in between.
+    """
+    KINDS = ('min', 'max', 'mean', 'last')
+
+    def __init__(self, resolution: float, capacity: int = ROLLUP_SIZE):
+        self.resolution = resolution
+        self.buffers = {kind: RingBuffer(capacity) for kind in self.KINDS}
+        self._bucket = None
+        self._count = 0
+        self._sum = 0.0
+        self._min = self._max = float('nan')
+        self._last = float('nan')
+
+    def gap(self):
+        """Marks the value unknown until the next sample, e.g. while unreachable."""
+        self._last = float('nan')
+
+    def _carry(self, bucket: float):
+        # Buckets between the last one and `bucket`, at most a buffer of them
+        if self._bucket is None or np.isnan(self._last):
+            return
+
+        missing = int(round((bucket - self._bucket) / self.resolution)) - 1
+        for i in range(max(missing - self.buffers['last'].capacity, 0), missing):
+            for buffer in self.buffers.values():
+                buffer.append(self._last, self._bucket + (i + 1) * self.resolution)
+
+    def add(self, value: float, timestamp: float):
+        bucket = timestamp // self.resolution * self.resolution
+        if bucket != self._bucket:
+            self._carry(bucket)
+            self._bucket = bucket
+            self._count, self._sum = 0, 0.0
+            self._min = self._max = value
+
+        self._count += 1
+        self._sum += value
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        self._last = value
+
+        aggregates = {
+            'min': self._min,
+            'max': self._max,
+            'mean': self._sum / self._count,
+            'last': value
+        }
+        for kind, buffer in self.buffers.items():
+            if self._count == 1:
+                buffer.append(aggregates[kind], bucket)
+            else:
+                buffer.update_last(aggregates[kind])
+
+
+class MetricHistory:
+    """Raw samples of one metric plus its rollups at ROLLUP_RESOLUTIONS."""
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        self.raw = RingBuffer(capacity)
+        self.rollups = {name: Rollup(resolution)
+                        for name, resolution in ROLLUP_RESOLUTIONS.items()}
+
+    def append(self, value: float, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        self.raw.append(value, timestamp)
+        if np.isnan(value):
+            for rollup in self.rollups.values():
+                rollup.gap()
+            return
+
+        for rollup in self.rollups.values():
+            rollup.add(value, timestamp)
+
+    def repeat(self, timestamp: float = None):
+        """Adds the latest raw sample to the rollups again, for a cycle it held through."""
+        value = self.raw.last
+        if np.isnan(value):
+            return
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        for rollup in self.rollups.values():
+            rollup.add(value, timestamp)
+
+    def buffer(self, zoom: str = 'raw', kind: str = 'max') -> RingBuffer:
+        """Samples of `zoom` ('raw' or a ROLLUP_RESOLUTIONS key), `kind` of rollups."""
+        if zoom == 'raw':
+            return self.raw
+
+        return self.rollups[zoom].buffers[kind]
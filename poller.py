@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from concurrent.futures import wait
+from typing import Callable, List
+
+import pydantic
+import requests
+
+from requesters import CYCLE_TIMEOUT, GetRequester, StreamRequester, StreamUnsupported
+from scheduler import PollScheduler
+
+
+class Poller:
+    """
+    Polls or streams a set of instances and hands their snapshots to
+    `emit`, as a dict of instance to snapshot.
+
+    It can be driven blocking with `run`, or one poll cycle at a time
+    from an event loop with `submit` and `finish`. All instances share
+    one bounded pool of workers and one CYCLE_TIMEOUT deadline per
+    cycle. `stop` ends either way of driving it and can be called from
+    any thread. `stopping` only needs `set`, `is_set` and `wait`, so a
+    `multiprocessing.Event` works as well.
+    """
+    def __init__(self, urls: List[str], emit: Callable[[dict], None], transport: str = 'poll',
+                 scheduler: PollScheduler = None, stopping=None):
+        self.urls = list(urls)
+        self.getters = {url: GetRequester(url) for url in self.urls}
+        self.emit = emit
+        self.transport = transport
+        self.scheduler = scheduler or PollScheduler()
+        self.stopping = stopping or threading.Event()
+        self._logger = logging.getLogger('poller')
+        self._streamer = None
+        # Futures of the running cycle per instance, empty between cycles
+        self._futures = {}
+        self._started = 0.0
+
+    @property
+    def streams(self) -> bool:
+        # A stream holds a connection per instance, so only one is streamed
+        return self.transport == 'stream' and len(self.urls) == 1
+
+    @property
+    def cycling(self) -> bool:
+        """Whether a cycle was submitted and not finished yet."""
+        return bool(self._futures)
+
+    @property
+    def settled(self) -> bool:
+        """Whether every request of the running cycle has finished."""
+        return all(future.done() for futures in self._futures.values() for future in futures)
+
+    def stop(self):
+        self.stopping.set()
+        if self._streamer is not None:
+            self._streamer.close()
+        for futures in list(self._futures.values()):
+            for future in futures:
+                future.cancel()
+
+    def stream(self) -> bool:
+        """
+        Emits the events pushed by the only instance until stopped, with
+        backoff between reconnects. Returns False if its server can't
+        stream them, the instance is to be polled instead.
+        """
+        url, = self.urls
+        self._streamer = StreamRequester(url)
+        while not self.stopping.is_set():
+            try:
+                for snapshot in self._streamer.events():
+                    self.scheduler.reset()
+                    if snapshot:
+                        self.emit({url: snapshot})
+            except StreamUnsupported as e:
+                self._logger.info(f'{e}, falling back to polling')
+                return False
+            except (requests.exceptions.RequestException, ValueError, KeyError,
+                    pydantic.ValidationError):
+                if not self.stopping.is_set():
+                    self._logger.warning('Event stream was interrupted')
+
+            if self.stopping.is_set():
+                break
+
+            # Disconnected, reconnect with backoff
+            snapshots = {url: {'status': 'unknown'}}
+            self.emit(snapshots)
+            self.stopping.wait(self.scheduler.next_interval(snapshots))
+
+        return True
+
+    def submit(self) -> list:
+        """Starts a poll cycle, returns the futures of all its requests."""
+        self._started = time.monotonic()
+        self._futures = {url: getter.submit() for url, getter in self.getters.items()}
+        return [future for futures in self._futures.values() for future in futures]
+
+    def finish(self) -> float:
+        """
+        Ends the running cycle with what has arrived so far, emits its
+        snapshots and returns the seconds to wait before the next one.
+        """
+        snapshots = {url: self.getters[url].collect(futures, 0)
+                     for url, futures in self._futures.items()}
+        self._futures = {}
+        self.emit(snapshots)
+        return self.scheduler.next_delay(snapshots, time.monotonic() - self._started)
+
+    def run(self):
+        """Streams or polls until stopped, on the calling thread."""
+        if self.streams and self.stream():
+            return
+
+        while not self.stopping.is_set():
+            wait(self.submit(), timeout=CYCLE_TIMEOUT)
+            delay = self.finish()
+            self.stopping.wait(delay)
@@ -1,76 +1,393 @@
+import json
 import logging
 import os
-from typing import Union
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterator, Optional, Union
 from dotenv import load_dotenv
 
 import pydantic
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv('.env')
 
+POOL_SIZE = int(os.environ.get('POOL_SIZE', 4))
+POOL_HOSTS = int(os.environ.get('POOL_HOSTS', 16))
+MAX_PARALLEL = int(os.environ.get('MAX_PARALLEL', 8))
+CONNECT_RETRIES = int(os.environ.get('CONNECT_RETRIES', 3))
+CYCLE_TIMEOUT = float(os.environ.get('CYCLE_TIMEOUT', 2))
+LOG_TAIL = os.environ.get('LOG_TAIL', '1') == '1'
+STREAM_TIMEOUT = float(os.environ.get('STREAM_TIMEOUT', 15))
+COMMAND_TIMEOUT = float(os.environ.get('COMMAND_TIMEOUT', 10))
+COMMAND_RETRIES = int(os.environ.get('COMMAND_RETRIES', 1))
+
+
+class ConnectionPool:
+    """
+    Keep-alive session shared between requesters.
+
+    Connect errors (e.g. the bot is restarting) are retried with a short
+    backoff, stale keep-alive sockets are replaced by urllib3 transparently.
+    """
+    def __init__(self, size: int = POOL_SIZE, hosts: int = POOL_HOSTS,
+                 retries: int = CONNECT_RETRIES):
+        self._adapter = HTTPAdapter(
+            pool_connections=hosts,
+            pool_maxsize=size,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                backoff_factor=0.1,
+                raise_on_status=False
+            )
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+    @property
+    def stats(self) -> dict:
+        new, requests_made = 0, 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new += pool.num_connections
+            requests_made += pool.num_requests
+
+        return {
+            'new': new,
+            'reused': max(requests_made - new, 0)
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_pool = None
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool()
+
+    return _pool
+
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Worker threads shared by all requesters, bounding parallel requests."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL,
+                                       thread_name_prefix='requester')
+
+    return _executor
+
 
 class GetRequester:
-    def __init__(self, url):
+    def __init__(self, url, pool: ConnectionPool = None,
+                 executor: ThreadPoolExecutor = None, tail: bool = LOG_TAIL):
         self._url = url
         self._res = None
         self._logger = logging.getLogger('requester')
+        self._pool = pool or get_pool()
+        self._executor = executor or get_executor()
 
-    @property
-    def response(self) -> Union[dict, None]:
-        self._logger.info(f'Requesting {self._url}...')
-        try:
-            # Status
-            self._logger.info(f'Getting bot status')
-            _status = requests.get(self._url)
-            _status = _status.json()['status'] if _status.ok else 'unknown'
-
-            # Vars
-            self._logger.info(f'Getting variables via {self._url + "vars"}')
-            _vars = requests.get(self._url + 'vars')
-            _vars = Vars(**_vars.json()) if _vars.ok else Vars(
-                latency=float('Nan'),
-                servers=0,
-                memory_used=float('Nan')
-            )
+        self._tail = tail
+        self._log_cursor = 0
+        self._log_generation = None
+        self._log_pending = None
+        self._log_lock = threading.Lock()
+        self._log_fetching = threading.Lock()
+
+        self._validators = {}
+        self._vars = None
+        self._vars_stale = False
 
-            # Log
+    def _get_status(self, timeout: float) -> str:
+        self._logger.info(f'Getting bot status')
+        res = self._pool.session.get(self._url, timeout=timeout)
+        return res.json()['status'] if res.ok else 'unknown'
+
+    def _conditional_get(self, endpoint: str, timeout: float,
+                         params: dict = None, conditional: bool = True) -> requests.Response:
+        """
+        GET with the validators (ETag / Last-Modified) of the previous
+        response to the same endpoint, a 304 means nothing has changed.
+        """
+        headers = self._validators.get(endpoint, {}) if conditional else {}
+        res = self._pool.session.get(self._url + endpoint, params=params,
+                                     headers=headers, timeout=timeout)
+        if res.ok and res.status_code != 304:
+            validators = {}
+            if 'ETag' in res.headers:
+                validators['If-None-Match'] = res.headers['ETag']
+            if 'Last-Modified' in res.headers:
+                validators['If-Modified-Since'] = res.headers['Last-Modified']
+            self._validators[endpoint] = validators
+
+        return res
+
+    def _get_vars(self, timeout: float) -> Union['Vars', None]:
+        self._logger.info(f'Getting variables via {self._url + "vars"}')
+        res = self._conditional_get('vars', timeout)
+        if res.status_code == 304:
+            # Unchanged, unless the last parsed vars never made it to a snapshot
+            return self._vars if self._vars_stale else None
+        if not res.ok:
+            return None
+
+        self._vars = Vars(**res.json())
+        return self._vars
+
+    def _get_log(self, timeout: float) -> None:
+        """
+        Fetches the log into the pending buffer taken by `_take_log`.
+
+        In tail mode only bytes past the cursor are requested, a shrunk log
+        or a new generation means the log was rotated and it is re-read
+        from the start. Results that arrive after the cycle deadline are
+        not lost, they are picked up by the next cycle.
+        """
+        if not self._log_fetching.acquire(blocking=False):
+            self._logger.info('Previous log request is still running')
+            return
+
+        try:
             self._logger.info(f'Getting logs via {self._url + "log"}')
-            _log = requests.get(self._url + 'log')
-            _log = Log(**_log.json()) if _log.ok else Log(content='')
-        except requests.exceptions.RequestException:
-            _status = 'unknown'
-            _log = Log(content='')
-            _vars = Vars(
-                latency=float('Nan'),
-                servers=0,
-                memory_used=float('Nan')
+            params = {'since': self._log_cursor} if self._tail else None
+            res = self._conditional_get('log', timeout, params=params)
+            if not res.ok or res.status_code == 304:
+                return
+
+            log = Log(**res.json())
+            if not self._tail or log.size is None:
+                # The whole log was sent back
+                self._tail = False
+                self._put_log(log)
+                return
+
+            rotated = log.size < self._log_cursor or (
+                self._log_cursor and log.generation != self._log_generation
             )
+            if rotated:
+                self._logger.info(f'Log of {self._url} was rotated, re-reading it')
+                res = self._conditional_get('log', timeout, params={'since': 0},
+                                            conditional=False)
+                if not res.ok:
+                    return
+                log = Log(**res.json())
+                self._log_cursor = 0
+
+            log.append = self._log_cursor > 0
+            self._log_cursor = log.size
+            self._log_generation = log.generation
+            self._put_log(log)
+        finally:
+            self._log_fetching.release()
+
+    def _put_log(self, log: 'Log'):
+        with self._log_lock:
+            if log.append and self._log_pending is not None:
+                # The cursor and generation are the newer chunk's
+                self._log_pending.content += log.content
+                self._log_pending.size = log.size
+                self._log_pending.generation = log.generation
+            else:
+                self._log_pending = log
+
+    def _take_log(self) -> Union['Log', None]:
+        with self._log_lock:
+            log, self._log_pending = self._log_pending, None
 
-            self._logger.warning(f'Failed requesting {self._url}...')
+        return log
 
+    def submit(self) -> dict:
+        """Starts one poll cycle, returns futures to pass to `collect`."""
+        self._logger.info(f'Requesting {self._url}...')
+        fetchers = {
+            'status': self._get_status,
+            'vars': self._get_vars,
+            'log': self._get_log
+        }
         return {
-            'status': _status,
-            'log': _log,
-            'vars': _vars
+            self._executor.submit(fetch, CYCLE_TIMEOUT): key
+            for key, fetch in fetchers.items()
         }
 
+    def collect(self, futures: dict, timeout: float = CYCLE_TIMEOUT) -> dict:
+        """
+        Waits up to `timeout` for the futures of `submit` and builds a snapshot.
+
+        Endpoints that failed, did not answer in time or answered with
+        304 Not Modified are left out of the snapshot, so the receiver
+        keeps their previous values.
+        """
+        done, not_done = wait(futures, timeout=timeout)
+
+        snapshot = {}
+        for future in done:
+            key = futures[future]
+            try:
+                value = future.result()
+            except (requests.exceptions.RequestException,
+                    ValueError, KeyError, pydantic.ValidationError):
+                self._logger.warning(f'Failed requesting {key} from {self._url}...')
+                self._validators.pop(key, None)
+                continue
+
+            if value is not None:
+                snapshot[key] = value
+
+        if 'vars' in snapshot:
+            self._vars_stale = False
+        elif any(futures[future] == 'vars' for future in not_done):
+            self._vars_stale = True
+
+        log = self._take_log()
+        if log is not None:
+            snapshot['log'] = log
+
+        for future in not_done:
+            future.cancel()
+            self._logger.warning(f'Timed out requesting {futures[future]} from {self._url}...')
+
+        snapshot.setdefault('status', 'unknown')
+        self._logger.debug(f'Connections: {self._pool.stats}')
+
+        return snapshot
+
+    @property
+    def response(self) -> dict:
+        """Fetches status, vars and log concurrently within one CYCLE_TIMEOUT."""
+        return self.collect(self.submit())
+
+
+class StreamUnsupported(Exception):
+    pass
+
+
+class StreamRequester:
+    """
+    Receives status, vars and log events pushed by the bot over one
+    long-lived Server-Sent Events connection to `/events`.
+
+    Every event is turned into a partial snapshot in the same format as
+    `GetRequester.response`. The server is expected to send a comment
+    line at least every STREAM_TIMEOUT seconds to keep the stream alive.
+    """
+    def __init__(self, url, pool: ConnectionPool = None):
+        self._url = url
+        self._logger = logging.getLogger('requester')
+        self._pool = pool or get_pool()
+        self._response = None
+        self._closed = False
+
+    def close(self):
+        """
+        Ends `events` from another thread. Closing the response would not
+        wake a thread blocked reading it, its socket is shut down instead.
+        """
+        self._closed = True
+        res = self._response
+        connection = res.raw.connection if res is not None else None
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def events(self) -> Iterator[dict]:
+        self._logger.info(f'Subscribing to {self._url + "events"}')
+        res = self._pool.session.get(self._url + 'events', stream=True,
+                                     timeout=(CYCLE_TIMEOUT, STREAM_TIMEOUT),
+                                     headers={'Accept': 'text/event-stream'})
+        content_type = res.headers.get('Content-Type', '')
+        if res.status_code in (404, 405, 501) or (
+                res.ok and not content_type.startswith('text/event-stream')):
+            res.close()
+            raise StreamUnsupported(f'{self._url} does not stream events')
+        res.raise_for_status()
+
+        self._response = res
+        if self._closed:
+            res.close()
+            return
+
+        # Event streams are always UTF-8, whatever the Content-Type says
+        res.encoding = 'utf-8'
+        with res:
+            event, data = None, []
+            for line in res.iter_lines(decode_unicode=True):
+                if not line:
+                    if data:
+                        yield self._snapshot(event or 'message', '\n'.join(data))
+                    event, data = None, []
+                elif line.startswith(':'):
+                    # Keep-alive comment
+                    continue
+                else:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'event':
+                        event = value
+                    elif field == 'data':
+                        data.append(value)
+
+    def _snapshot(self, event: str, data: str) -> dict:
+        payload = json.loads(data)
+        if event == 'status':
+            return {'status': payload['status']}
+        if event == 'vars':
+            return {'vars': Vars(**payload)}
+        if event == 'log':
+            return {'log': Log(**payload)}
+
+        self._logger.warning(f'Unknown event {event} from {self._url}')
+        return {}
+
 
 class PostRequester:
-    def __init__(self, url):
+    def __init__(self, url, pool: ConnectionPool = None):
         self._url = url
         self._res = None
         self._logger = logging.getLogger('requester')
+        self._pool = pool or get_pool()
 
         self.user = os.environ.get('app_username')
         self.password = os.environ.get('app_password')
 
-    def post(self, instruction):
+    def post(self, instruction, key: str = None):
+        """
+        Sends `instruction`, servers apply it once per idempotency `key`.
+        Only commands with a key are retried when the connection fails,
+        it may have failed after the bot got the command.
+        """
         payload = {
             'Authorization': f'{self.user}:{self.password}'
         }
+        if key is not None:
+            payload['Idempotency-Key'] = key
 
-        res = requests.post(self._url + instruction, headers=payload)
-        return res
+        retries = COMMAND_RETRIES if key is not None else 0
+        for attempt in range(retries + 1):
+            try:
+                return self._pool.session.post(self._url + instruction, headers=payload,
+                                               timeout=COMMAND_TIMEOUT)
+            except requests.ConnectionError:
+                if attempt == retries:
+                    raise
+                self._logger.info(f'Retrying {instruction} on {self._url} ({key})')
 
 
 class Vars(pydantic.BaseModel):
@@ -81,3 +398,26 @@ class Vars(pydantic.BaseModel):
 
 class Log(pydantic.BaseModel):
     content: str
+    # Set by servers supporting `?since=<offset>` tailing
+    size: Optional[int] = None
+    generation: Optional[str] = None
+    # Whether content continues the previously received log
+    append: bool = False
+
+
+class CommandResult(pydantic.BaseModel):
+    instruction: str
+    instance: str
+    key: str
+    # Identical commands issued while this one was pending
+    merged: int = 0
+    # None if no response came back, see `error`
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    # Seconds spent in the queue and on the request
+    waited: float
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and self.status_code < 400
@@ -0,0 +1,97 @@
+import os
+import random
+
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', 0.3))
+IDLE_INTERVAL = float(os.environ.get('IDLE_INTERVAL', 3))
+BACKGROUND_INTERVAL = float(os.environ.get('BACKGROUND_INTERVAL', 5))
+MAX_BACKOFF = float(os.environ.get('MAX_BACKOFF', 30))
+# Characters at the end of a log that its fingerprint hashes
+FINGERPRINT_TAIL = 4096
+
+
+def fingerprint(field: str, value):
+    """Stands in for a snapshot field in comparisons, logs by length plus a hash of their tail."""
+    if field == 'log':
+        return len(value.content), hash(value.content[-FINGERPRINT_TAIL:])
+
+    return value
+
+
+class PollScheduler:
+    """
+    Decides how long to wait before the next poll cycle.
+
+    Polls every `fast` seconds while snapshots keep changing and slows
+    down towards `idle` while they don't. While the bot is unreachable the
+    interval grows exponentially up to `max_backoff`, with jitter so that
+    several consoles don't hammer a restarting bot in lockstep.
+    """
+    def __init__(self,
+                 fast: float = POLL_INTERVAL,
+                 idle: float = IDLE_INTERVAL,
+                 background: float = BACKGROUND_INTERVAL,
+                 max_backoff: float = MAX_BACKOFF):
+        self.fast = fast
+        self.idle = idle
+        self.background_interval = background
+        self.max_backoff = max_backoff
+
+        # Set while the window is minimized
+        self.background = False
+
+        self.interval = fast
+        self._failures = 0
+        # Latest fingerprint of every field of every instance
+        self._fingerprints = {}
+
+    def reset(self):
+        self.interval = self.fast
+        self._failures = 0
+
+    @staticmethod
+    def is_unreachable(snapshot: dict) -> bool:
+        return set(snapshot) == {'status'} and snapshot['status'] == 'unknown'
+
+    def is_changed(self, instance: str, snapshot: dict) -> bool:
+        # Fields left out (304 Not Modified) are unchanged, bots without
+        # ETags send them every time so they are compared too
+        changed = False
+        for field, value in snapshot.items():
+            key = (instance, field)
+            if field == 'log' and value.append:
+                # The whole log isn't known here anymore
+                self._fingerprints.pop(key, None)
+                changed |= bool(value.content)
+                continue
+
+            current = fingerprint(field, value)
+            changed |= self._fingerprints.get(key) != current
+            self._fingerprints[key] = current
+
+        return changed
+
+    def next_interval(self, snapshots: dict) -> float:
+        """`snapshots` maps every polled instance to its latest snapshot."""
+        # Compared even while unreachable, so that coming back counts as a change
+        changed = [self.is_changed(instance, snapshot)
+                   for instance, snapshot in snapshots.items()]
+        if all(self.is_unreachable(snapshot) for snapshot in snapshots.values()):
+            self._failures += 1
+            backoff = min(self.max_backoff, self.fast * 2 ** self._failures)
+            self.interval = random.uniform(backoff / 2, backoff)
+            return self.interval
+
+        self._failures = 0
+        if any(changed):
+            self.interval = self.fast
+        else:
+            self.interval = min(self.idle, self.interval * 1.5)
+
+        if self.background:
+            return max(self.interval, self.background_interval)
+
+        return self.interval
+
+    def next_delay(self, snapshots: dict, elapsed: float) -> float:
+        """Time left to sleep, given the cycle itself took `elapsed` seconds."""
+        return max(0.0, self.next_interval(snapshots) - elapsed)
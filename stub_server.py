@@ -0,0 +1,235 @@
+"""
+Stand-in for the bot's HTTP API, for running the console locally:
+
+    python stub_server.py --port 8000
+    APPLICATION_URL=http://127.0.0.1:8000/ python index.py
+
+Serves `/`, `/vars` and a growing `/log` which supports `?since=<offset>`
+tailing and is rotated every `--rotate` seconds if set. `/vars` and `/log`
+answer conditional requests with 304 Not Modified. `/events` pushes the
+same data as Server-Sent Events unless `--no-events` is given.
+POST `/launch`, `/terminate` and `/restart` take `--command-delay`
+seconds and are applied once per `Idempotency-Key` header.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LEVELS = ['INFO'] * 8 + ['WARNING'] * 2 + ['ERROR']
+
+
+class BotState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = 'online'
+        self.log = bytearray()
+        self.generation = 0
+        self.cpu = 0.1
+        self.memory = 120.0
+        self.servers = 3
+        # Latest commands by idempotency key, with their response once applied
+        self.commands = OrderedDict()
+
+    def write_line(self):
+        line = (f'{time.strftime("%Y-%m-%d %H:%M:%S")} - '
+                f'{random.choice(LEVELS)} - bot:\tProcessed event '
+                f'#{random.randint(0, 10 ** 6)}\n')
+        with self.lock:
+            self.log += line.encode()
+            self.cpu = max(0.0, min(0.5, self.cpu + random.uniform(-0.02, 0.02)))
+            self.memory = max(0.0, min(512.0, self.memory + random.uniform(-2, 2)))
+
+    def rotate(self):
+        with self.lock:
+            self.log = bytearray()
+            self.generation += 1
+
+    def vars(self) -> dict:
+        with self.lock:
+            return {
+                'cpu_used': round(self.cpu, 3),
+                'servers': self.servers,
+                'memory_used': f'{self.memory:.1f}M'
+            }
+
+    def tail(self, since: int) -> dict:
+        with self.lock:
+            size = len(self.log)
+            chunk = self.log[since:] if since <= size else b''
+            return {
+                'content': chunk.decode(errors='replace'),
+                'size': size,
+                'generation': str(self.generation)
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: BotState = None
+    events = True
+    command_delay = 0.0
+
+    def _send_json(self, data: dict, code: int = 200, etag: str = None):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self, etag: str) -> bool:
+        if self.headers.get('If-None-Match') != etag:
+            return False
+
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/':
+            self._send_json({'status': self.state.status})
+        elif url.path == '/vars':
+            data = self.state.vars()
+            etag = f'"{hash(json.dumps(data, sort_keys=True)):x}"'
+            if not self._not_modified(etag):
+                self._send_json(data, etag=etag)
+        elif url.path == '/log':
+            since = parse_qs(url.query).get('since', ['0'])[0]
+            data = self.state.tail(int(since))
+            etag = f'"{data["generation"]}-{data["size"]}"'
+            if not self._not_modified(etag):
+                self._send_json(data, etag=etag)
+        elif url.path == '/events' and self.events:
+            self.stream_events()
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_event(self, event: str, data: dict):
+        self._send_chunk(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode())
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        status, vars_, cursor, generation = None, None, 0, None
+        last_sent = time.monotonic()
+        try:
+            while True:
+                if self.state.status != status:
+                    status = self.state.status
+                    self._send_event('status', {'status': status})
+                if self.state.vars() != vars_:
+                    vars_ = self.state.vars()
+                    self._send_event('vars', vars_)
+
+                log = self.state.tail(cursor)
+                if log['generation'] != generation or log['size'] < cursor:
+                    log = self.state.tail(0)
+                    generation, cursor = log['generation'], 0
+                    log['append'] = False
+                    self._send_event('log', log)
+                    last_sent = time.monotonic()
+                elif log['content']:
+                    log['append'] = True
+                    self._send_event('log', log)
+                    last_sent = time.monotonic()
+                cursor = log['size']
+
+                if time.monotonic() - last_sent > 5:
+                    self._send_chunk(b': keep-alive\n\n')
+                    last_sent = time.monotonic()
+
+                time.sleep(0.1)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_POST(self):
+        instruction = urlparse(self.path).path.strip('/')
+        statuses = {'launch': 'online', 'terminate': 'offline', 'restart': 'online'}
+        if instruction not in statuses:
+            self._send_json({'error': 'not found'}, 404)
+            return
+
+        key = self.headers.get('Idempotency-Key')
+        with self.state.lock:
+            entry = self.state.commands.get(key) if key is not None else None
+            reserved = None
+            if entry is None and key is not None:
+                # Reserved before applying, a retry arriving meanwhile waits for it
+                reserved = self.state.commands[key] = {'applied': threading.Event(), 'response': None}
+                while len(self.state.commands) > 256:
+                    self.state.commands.popitem(last=False)
+
+        if entry is not None:
+            entry['applied'].wait()
+            logging.getLogger('stub_server').info(f'Replaying {instruction} {key}')
+            self._send_json(entry['response'])
+            return
+
+        time.sleep(self.command_delay)
+        with self.state.lock:
+            self.state.status = statuses[instruction]
+            response = {'status': self.state.status}
+        if reserved is not None:
+            reserved['response'] = response
+            reserved['applied'].set()
+        logging.getLogger('stub_server').info(f'Applied {instruction} {key}')
+        self._send_json(response)
+
+    def log_message(self, format, *args):
+        logging.getLogger('stub_server').debug(format % args)
+
+
+def generate(state: BotState, rate: float, rotate: float):
+    rotated_at = time.monotonic()
+    while True:
+        state.write_line()
+        if rotate and time.monotonic() - rotated_at > rotate:
+            state.rotate()
+            rotated_at = time.monotonic()
+
+        time.sleep(1 / rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in bot server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rate', type=float, default=20, help='log lines per second')
+    parser.add_argument('--rotate', type=float, default=0, help='rotate log every N seconds')
+    parser.add_argument('--no-events', action='store_true', help='disable the /events stream')
+    parser.add_argument('--command-delay', type=float, default=0, help='seconds a command takes')
+    args = parser.parse_args()
+
+    Handler.events = not args.no_events
+    Handler.command_delay = args.command_delay
+    logging.basicConfig(level=logging.INFO)
+    Handler.state = BotState()
+    threading.Thread(target=generate, args=(Handler.state, args.rate, args.rotate),
+                     daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logging.getLogger('stub_server').info(f'Serving on http://{args.host}:{args.port}/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()